@@ -1,4 +1,5 @@
 import yappi
+import sys
 import threading
 import time
 import lazyflow
@@ -227,3 +228,30 @@ print "\n\n"
 print "LAZYFLOW POOL WAIT:   %f seconds for %d iterations" % (t2-t1,mcount)
 print "                                %0.3fms latency" % ((t2-t1)*1e3/mcount,)
 
+
+
+
+# per request cost of requests that are created, executed and waited
+# for inside of a request, i.e. on the greenlets of the workers
+def spawn_requests(n):
+    requests = [Request(empty_func, b = 11) for i in range(n)]
+    for r in requests:
+        r.submit()
+    for r in requests:
+        r.wait()
+
+t1 = time.time()
+Request(spawn_requests, n = 50000).submit().wait()
+t2 = time.time()
+print "\n\n"
+print "LAZYFLOW CHILD REQUEST OVERHEAD:   %f seconds for %d iterations" % (t2-t1,50000)
+print "                                %fus latency" % ((t2-t1)*1e6/50000,)
+
+
+r = Request(empty_func, b = 11)
+size = sys.getsizeof(r)
+if hasattr(r, "__dict__"):
+    size += sys.getsizeof(r.__dict__)
+print "\n\n"
+print "LAZYFLOW REQUEST OBJECT SIZE:   %d bytes" % size
+r.wait()
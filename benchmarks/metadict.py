@@ -0,0 +1,82 @@
+import time
+import numpy
+from lazyflow.graph import Graph, MetaDict
+from lazyflow import operators
+
+mcount = 200000
+mcountr = 20000
+
+meta = MetaDict()
+meta.shape = (100, 100, 100, 1)
+meta.dtype = numpy.uint8
+meta.axistags = "xyzc"
+meta.drange = (0, 255)
+meta._ready = True
+
+def report(name, t1, t2, count):
+    print "\n\n"
+    print "%-32s%f seconds for %d iterations" % (name + ":", t2 - t1, count)
+    print "                                %fus latency" % ((t2 - t1) * 1e6 / count,)
+
+
+t1 = time.time()
+for i in range(0, mcount):
+    meta.shape
+    meta.dtype
+    meta.axistags
+t2 = time.time()
+report("METADICT HOT KEYS (3 READS)", t1, t2, mcount)
+
+t1 = time.time()
+for i in range(0, mcount):
+    meta.drange
+t2 = time.time()
+report("METADICT OTHER KEY", t1, t2, mcount)
+
+t1 = time.time()
+for i in range(0, mcount):
+    meta.description
+t2 = time.time()
+report("METADICT MISSING KEY", t1, t2, mcount)
+
+t1 = time.time()
+for i in range(0, mcount):
+    meta["shape"]
+t2 = time.time()
+report("METADICT GETITEM", t1, t2, mcount)
+
+t1 = time.time()
+for i in range(0, mcount):
+    meta.shape = (100, 100, 100, 1)
+t2 = time.time()
+report("METADICT SETATTR", t1, t2, mcount)
+
+t1 = time.time()
+for i in range(0, mcountr):
+    meta.copy()
+t2 = time.time()
+report("METADICT COPY", t1, t2, mcountr)
+
+other = MetaDict()
+t1 = time.time()
+for i in range(0, mcountr):
+    other.assignFrom(meta)
+    other.shape = (1,)
+t2 = time.time()
+report("METADICT ASSIGNFROM", t1, t2, mcountr)
+
+
+# the slot requests of a small operator chain read the meta
+# data of their slots in Slot.get, SubRegion and execute
+g = Graph()
+arr = numpy.zeros((100, 100, 100, 1), numpy.uint8)
+p1 = operators.OpArrayPiper(graph = g)
+p1.Input.setValue(arr)
+p2 = operators.OpArrayPiper(graph = g)
+p2.Input.connect(p1.Output)
+
+t1 = time.time()
+for i in range(0, mcountr):
+    p2.Output[3:4, 3:4, 3:4, :].wait()
+t2 = time.time()
+report("LAZYFLOW REQUEST", t1, t2, mcountr)
@@ -0,0 +1,124 @@
+"""
+This module pins threads to cpus and groups the cpus of the
+machine by memory locality (NUMA nodes, or sockets if the node
+topology is not available). It is used by ThreadPools that are
+created with an affinity mode, see ThreadPool.
+
+All functions degrade gracefully: on systems without
+sched_setaffinity threads are simply not pinned, and machines
+without topology information form a single group.
+"""
+
+import os
+import glob
+import ctypes
+import ctypes.util
+
+from helpers import detectCPUs
+
+_CPU_SETSIZE = 1024
+_ULONG_BITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+
+class _CpuSet(ctypes.Structure):
+    _fields_ = [("bits", ctypes.c_ulong * (_CPU_SETSIZE / _ULONG_BITS))]
+
+_libc = None
+
+def _getLibc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno = True)
+            libc.sched_setaffinity
+            libc.sched_getaffinity
+            _libc = libc
+        except (OSError, AttributeError):
+            _libc = False
+    return _libc
+
+
+def _parseCpuList(text):
+    """
+    parse a cpu list of the kernel, e.g. "0-3,8-11"
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def allowedCpus():
+    """
+    Return the sorted list of cpus the process may run on.
+    """
+    libc = _getLibc()
+    if libc:
+        mask = _CpuSet()
+        if libc.sched_getaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) == 0:
+            return [cpu for cpu in range(_CPU_SETSIZE)
+                    if mask.bits[cpu / _ULONG_BITS] & (1 << (cpu % _ULONG_BITS))]
+    return range(detectCPUs())
+
+def cpuGroups(sysfs = "/sys/devices/system"):
+    """
+    Return the allowed cpus grouped by memory locality, as a list of
+    sorted cpu lists: one list per NUMA node, or per socket if there
+    is no node information, or a single list.
+    """
+    allowed = set(allowedCpus())
+    groups = []
+    for path in sorted(glob.glob(os.path.join(sysfs, "node", "node[0-9]*", "cpulist"))):
+        with open(path) as f:
+            groups.append(_parseCpuList(f.read()))
+    if len(groups) == 0:
+        sockets = {}
+        for path in glob.glob(os.path.join(sysfs, "cpu", "cpu[0-9]*", "topology", "physical_package_id")):
+            cpu = int(os.path.basename(os.path.dirname(os.path.dirname(path)))[3:])
+            with open(path) as f:
+                sockets.setdefault(int(f.read()), []).append(cpu)
+        groups = [sockets[socket] for socket in sorted(sockets)]
+    groups = [sorted(allowed.intersection(group)) for group in groups]
+    groups = [group for group in groups if len(group) > 0]
+    if len(groups) == 0:
+        groups = [sorted(allowed)]
+    return groups
+
+def pinCurrentThread(cpus):
+    """
+    Restrict the calling thread to the given cpus.
+
+    Returns False if the affinity could not be set.
+    """
+    libc = _getLibc()
+    if not libc:
+        return False
+    mask = _CpuSet()
+    for cpu in cpus:
+        mask.bits[cpu / _ULONG_BITS] |= 1 << (cpu % _ULONG_BITS)
+    # pid 0 is the calling thread
+    return libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) == 0
+
+def workerPlacement(index, mode, groups):
+    """
+    Return the cpus and the group index of a worker of a ThreadPool.
+
+    Arguments:
+      index  : number of the worker
+      mode   : "cores"  - the workers are pinned to single cpus, round robin
+               "groups" - the workers are distributed round robin over the
+                          groups and pinned to all cpus of their group
+      groups : the cpu groups, see cpuGroups()
+    """
+    if mode == "cores":
+        cpus = [(cpu, g) for g, group in enumerate(groups) for cpu in group]
+        cpu, g = cpus[index % len(cpus)]
+        return [cpu], g
+    elif mode == "groups":
+        g = index % len(groups)
+        return groups[g], g
+    raise ValueError("unknown affinity mode %r" % (mode,))
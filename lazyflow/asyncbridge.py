@@ -0,0 +1,85 @@
+"""
+This module makes lazyflow requests awaitable from an asyncio
+event loop (or a trollius loop under python 2).
+
+Basic usage example:
+
+---
+from lazyflow.asyncbridge import requestFuture
+
+@asyncio.coroutine
+def serveTile(op, key):
+    data = yield From(requestFuture(op.Output[key]))
+    ...
+---
+
+requestFuture submits the request and returns a future of the
+event loop, which is completed from the finish callback of the
+request via loop.call_soon_threadsafe. The loop thread never
+blocks, so a single thread can have any number of outstanding
+requests. Cancelling the future cancels the request and vice versa.
+If the request raises, the exception is set on the future.
+
+Under python 2 the trollius package is required.
+"""
+
+def _asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    return asyncio
+
+
+def _setResult(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _setException(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+def _cancel(future):
+    if not future.done():
+        future.cancel()
+
+
+def requestFuture(request, loop = None):
+    """
+    Return a future of the event loop for the result of the request.
+
+    Arguments:
+      request : a request.Request or a graph.ValueRequest
+      loop    : the event loop that awaits the future, defaults to
+                the event loop of the calling thread
+    """
+    asyncio = _asyncio()
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if hasattr(loop, "create_future"):
+        future = loop.create_future()
+    else:
+        future = asyncio.Future(loop = loop)
+
+    def finished(request):
+        # called in the thread that executed the request
+        loop.call_soon_threadsafe(_setResult, future, request.result)
+
+    def canceled(request):
+        loop.call_soon_threadsafe(_cancel, future)
+        return True
+
+    def futureDone(future):
+        if future.cancelled():
+            request.cancel()
+
+    def failed(request, exception):
+        # the finish callbacks of a failed request are never called
+        loop.call_soon_threadsafe(_setException, future, exception)
+
+    request.onCancel(canceled)
+    request.onFailure(failed)
+    request.onFinish(finished)
+    future.add_done_callback(futureDone)
+    request.submit()
+    return future
@@ -0,0 +1,155 @@
+"""
+This module records the executed requests and writes them in the
+trace event format of the chrome trace viewer (chrome://tracing).
+
+Basic usage example:
+
+---
+from lazyflow.chrometrace import ChromeTrace
+
+with ChromeTrace() as trace:
+    result = op.Output[:].wait()
+trace.save("request-trace.json")
+---
+
+Every request is shown as an asynchronous span that is labeled with
+the operator and slot it computes (or the name of its function for
+plain requests), the roi and the id of its parent request are
+attached as arguments. Time a request spends in Request.wait is shown
+as a nested "wait" span, time a Worker sleeps because there is nothing
+to do is shown as an "idle" span on the track of the worker thread.
+"""
+
+import os
+import json
+import time
+import threading
+
+from lazyflow.request import Request
+
+
+def _requestId(request):
+    return "0x%x" % id(request)
+
+
+class ChromeTrace(object):
+    """
+    Records the requests that are executed between start() and stop().
+
+    Only one trace can be active at a time. While it is active
+    Request.EnableInstrumentation is set.
+    """
+
+    def __init__(self):
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._origin = None
+        self._previousInstrumentation = None
+
+    def start(self):
+        assert Request.tracer is None, "another trace is active"
+        self._origin = time.time()
+        self._previousInstrumentation = Request.EnableInstrumentation
+        Request.EnableInstrumentation = True
+        Request.tracer = self
+        return self
+
+    def stop(self):
+        if Request.tracer is self:
+            Request.tracer = None
+            Request.EnableInstrumentation = self._previousInstrumentation
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _timestamp(self, t):
+        # microseconds since the start of the trace
+        return (t - self._origin) * 1e6
+
+    def _tid(self, thread):
+        tid = thread.ident
+        if tid not in self._threads:
+            self._threads[tid] = thread.name
+        return tid
+
+    def _requestFinished(self, request):
+        """
+        called by an instrumented request in the thread that executed it.
+        """
+        thread = threading.current_thread()
+        args = { "parent" : None, "worker" : request.workerId }
+        if request.parent_request is not None:
+            args["parent"] = _requestId(request.parent_request)
+        roi = request.kwargs.get("roi")
+        if roi is not None:
+            args["roi"] = str(roi)
+        if request.submitTime is not None:
+            args["queueLatency [ms]"] = (request.startTime - request.submitTime) * 1e3
+        name = request.describe()
+        rid = _requestId(request)
+        with self._lock:
+            tid = self._tid(thread)
+            self._events.append({ "name" : name, "cat" : "request", "ph" : "b", "id" : rid,
+                                  "ts" : self._timestamp(request.startTime),
+                                  "pid" : self._pid, "tid" : tid, "args" : args })
+            self._events.append({ "name" : name, "cat" : "request", "ph" : "e", "id" : rid,
+                                  "ts" : self._timestamp(request.finishTime),
+                                  "pid" : self._pid, "tid" : tid })
+
+    def _requestWaited(self, thread, waiter, request, start, stop):
+        """
+        called by Request.wait after the thread waited for request,
+        waiter is the request that was waiting or None.
+        """
+        args = { "request" : _requestId(request), "name" : request.describe() }
+        with self._lock:
+            tid = self._tid(thread)
+            if waiter is not None:
+                # nested into the span of the waiting request
+                rid = _requestId(waiter)
+                self._events.append({ "name" : "wait", "cat" : "request", "ph" : "b", "id" : rid,
+                                      "ts" : self._timestamp(start),
+                                      "pid" : self._pid, "tid" : tid, "args" : args })
+                self._events.append({ "name" : "wait", "cat" : "request", "ph" : "e", "id" : rid,
+                                      "ts" : self._timestamp(stop),
+                                      "pid" : self._pid, "tid" : tid })
+            else:
+                self._events.append({ "name" : "wait", "cat" : "thread", "ph" : "X",
+                                      "ts" : self._timestamp(start),
+                                      "dur" : (stop - start) * 1e6,
+                                      "pid" : self._pid, "tid" : tid, "args" : args })
+
+    def _workerIdle(self, worker, start, stop):
+        """
+        called by a Worker after it slept because it had nothing to do.
+        """
+        with self._lock:
+            self._events.append({ "name" : "idle", "cat" : "worker", "ph" : "X",
+                                  "ts" : self._timestamp(start),
+                                  "dur" : (stop - start) * 1e6,
+                                  "pid" : self._pid, "tid" : self._tid(worker) })
+
+    def events(self):
+        """
+        Return the list of recorded trace events, including
+        the metadata events that name the threads.
+        """
+        with self._lock:
+            events = list(self._events)
+            threads = self._threads.items()
+        for tid, name in threads:
+            events.append({ "name" : "thread_name", "ph" : "M", "pid" : self._pid,
+                            "tid" : tid, "args" : { "name" : name } })
+        return events
+
+    def save(self, filename):
+        """
+        Write the trace in the json format of the chrome trace viewer.
+        """
+        with open(filename, "w") as f:
+            json.dump({ "traceEvents" : self.events(), "displayTimeUnit" : "ms" }, f)
@@ -34,6 +34,8 @@ import copy
 import psutil
 import functools
 import collections
+import contextlib
+import weakref
 import itertools
 
 if int(psutil.__version__.split(".")[0]) < 1 and int(psutil.__version__.split(".")[1]) < 3:
@@ -43,9 +45,10 @@ if int(psutil.__version__.split(".")[0]) < 1 and int(psutil.__version__.split(".
 import threading
 import logging
 
-from request import Request, Singleton
+from request import Request, Singleton, ThreadPool, global_thread_pool, global_memory_budget, ioThreadPool
 import rtype
 from lazyflow.stype import ArrayLike
+from lazyflow.roi import roiToSlice
 from lazyflow import slicingtools
 
 from lazyflow.tracer import Tracer
@@ -53,55 +56,105 @@ from lazyflow.tracer import Tracer
 class OrderedSignal(object):
     """
     A callback mechanism that ensures callbacks occur in the same order as subscription.
+
+    Unsubscribed callbacks leave a None entry in the callback list,
+    the list is compacted when more than half of it are such entries.
     """
+    __slots__ = ("callbacks", "_index", "_removed")
+
     def __init__(self):
-        self.callbacks = []
+        self.callbacks = []  # (function, kwargs) in the order of subscription, or None
+        self._index = {}     # function -> position in callbacks
+        self._removed = 0    # number of None entries in callbacks
 
     def subscribe(self, fn, **kwargs):
         # Remove this function if we already have it
         self.unsubscribe(fn)
         # Add it to the end
+        self._index[fn] = len(self.callbacks)
         self.callbacks.append((fn, kwargs))
 
     def unsubscribe(self, fn):
-        # Find this function and remove its entry
-        for i, (f, kw) in enumerate(self.callbacks):
-            if f == fn:
-                self.callbacks.pop(i)
-                break
+        i = self._index.pop(fn, None)
+        if i is None:
+            return
+        self.callbacks[i] = None
+        self._removed += 1
+        if 2 * self._removed > len(self.callbacks):
+            # a new list, an emission that is in progress continues with the old one
+            self.callbacks = [entry for entry in self.callbacks if entry is not None]
+            self._index = dict((entry[0], i) for i, entry in enumerate(self.callbacks))
+            self._removed = 0
 
     def __call__(self, *args):
         """
         Emit the signal.
         """
-        for f, kw in self.callbacks:
-            f(*args, **kw)
+        for entry in self.callbacks:
+            if entry is not None:
+                entry[0](*args, **entry[1])
+
+class _NoSignal(object):
+    """
+    Shared placeholder for the signals of slots that have no
+    subscribers, see Slot._subscribe.
+    """
+    __slots__ = ()
+
+    def __call__(self, *args):
+        pass
+
+    def unsubscribe(self, fn):
+        pass
+
+_noSignal = _NoSignal()
+
+# protects the lazy creation of the conditions of slots
+_slotConditionLock = threading.Lock()
+
+# values that copy.copy() returns unchanged
+_immutableMetaTypes = frozenset((type(None), bool, int, long, float, complex, str, unicode,
+                                 tuple, frozenset, type, numpy.dtype))
 
 class MetaDict(dict):
     """
     Helper class that manages the dirty state of the meta data of a slot.
     changing a meta dicts attributes sets it _dirty flag True.
+
+    The most frequently read entries are mirrored in slots, so that
+    reading them as attributes does not go through __getattr__.
     """
+    __slots__ = ("shape", "dtype", "axistags", "_ready", "_dirty")
+
     def __init__(self, other=False):
         if(other):
             dict.__init__(self,other)
         else:
             dict.__init__(self)
             self._ready = False  # flag that indicates wether all dependencies of the slot are ready
+        self._syncSlots()
         self._dirty = True   # flag that indicates wether any piece of meta information changed
                              # since this flag was reset
 
+    def _syncSlots(self):
+        get = dict.get
+        setSlot = object.__setattr__
+        setSlot(self, "shape", get(self, "shape"))
+        setSlot(self, "dtype", get(self, "dtype"))
+        setSlot(self, "axistags", get(self, "axistags"))
+        setSlot(self, "_ready", get(self, "_ready"))
+        setSlot(self, "_dirty", get(self, "_dirty"))
+
     def __setattr__(self,name,value):
         """
         Provide convenient acces to the metadict, allows using the . notation instead of [] access
         """
-        if self.has_key(name):
-            changed = True
+        if name in self:
             try:
-                if self[name] == value:
-                    changed = False
-            except KeyError:
-                pass
+                changed = not (dict.__getitem__(self, name) == value)
+            except ValueError:
+                # e.g. arrays, whose comparison is ambiguous
+                changed = True
             if changed:
                 self["_dirty"] = True
         self[name] = value
@@ -111,23 +164,63 @@ class MetaDict(dict):
         """
         Provide convenient acces to the metadict, allows using the . notation instead of [] access
         """
-        return self[name]
+        if name[:2] == "__":
+            raise AttributeError(name)
+        return dict.get(self, name)
 
     def __getitem__(self, name):
         """
         Does not throw KeyErrors.
         Non-existant items always return None.
         """
-        if name in self.keys():
-            return dict.__getitem__(self, name)
-        else:
-            return None
+        return dict.get(self, name)
+
+    def __setitem__(self, name, value):
+        dict.__setitem__(self, name, value)
+        if name in _metaSlots:
+            object.__setattr__(self, name, value)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        if name in _metaSlots:
+            object.__setattr__(self, name, None)
+
+    def clear(self):
+        dict.clear(self)
+        self._syncSlots()
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._syncSlots()
+
+    def pop(self, *args):
+        result = dict.pop(self, *args)
+        self._syncSlots()
+        return result
+
+    def popitem(self):
+        result = dict.popitem(self)
+        self._syncSlots()
+        return result
+
+    def setdefault(self, name, value = None):
+        if name not in self:
+            self[name] = value
+        return dict.__getitem__(self, name)
+
+    def __reduce__(self):
+        # pickle and copy.copy restore the items, including the flags
+        return (MetaDict, (), None, None, self.iteritems())
 
     def copy(self):
         """
         Construct a copy of the meta dict
         """
-        return MetaDict(dict.copy(self))
+        result = dict.__new__(MetaDict)
+        dict.update(result, self)
+        dict.__setitem__(result, "_dirty", True)
+        result._syncSlots()
+        return result
 
     def assignFrom(self, other):
         """
@@ -137,13 +230,16 @@ class MetaDict(dict):
         origdirty = self._dirty
         origready = self._ready
         if dirty:
-            self.clear()
-            for k,v in other.items():
-                self[k] = copy.copy(v)
-        self._dirty = origdirty | dirty
+            dict.clear(self)
+            for k,v in other.iteritems():
+                if type(v) not in _immutableMetaTypes:
+                    v = copy.copy(v)
+                dict.__setitem__(self, k, v)
+        dict.__setitem__(self, "_dirty", origdirty | dirty)
 
         # Readiness can't be assigned.  It can only be assigned in _setupOutputs or setValue (or copied via _changed)
-        self._ready = origready
+        dict.__setitem__(self, "_ready", origready)
+        self._syncSlots()
 
     def getTaggedShape(self):
         """
@@ -154,6 +250,8 @@ class MetaDict(dict):
         keys = [tag.key for tag in self.axistags]
         return collections.OrderedDict( zip(keys, self.shape) )
 
+_metaSlots = frozenset(MetaDict.__slots__)
+
 class ValueRequest(object):
     """
     Pseudo request that behaves like a request.Request object
@@ -161,10 +259,13 @@ class ValueRequest(object):
     this object is used to prevent the heavy construction of complete Request
     objects in simple cases where they are not needed.
     """
+    canceled = False
+
     def __init__(self, value):
         self.result = value
 
-    def wait(self):
+    def wait(self, timeout = None):
+        # the value is available immediately, the timeout never expires
         return self.result
 
     def submit(self):
@@ -179,6 +280,9 @@ class ValueRequest(object):
     def onFinish(self, callback, **kwargs):
         callback(self, **kwargs)
 
+    def onFailure(self, callback, **kwargs):
+        pass
+
     def clean(self):
         self.result = None
 
@@ -198,12 +302,27 @@ class Slot(object):
     Base class for InputSlot, OutputSlot
     """
 
+    # workflows create many slots, keep them small
+    __slots__ = ("partners", "name", "_optional", "operator", "partner", "level", "_value",
+                 "_defaultValue", "_backpropagate_values", "rtype", "meta", "_subSlots",
+                 "_stypeType", "stype", "_type",
+                 "_sig_changed", "_sig_ready", "_sig_unready", "_sig_dirty", "_sig_connect",
+                 "_sig_disconnect", "_sig_resize", "_sig_resized", "_sig_remove",
+                 "_sig_removed", "_sig_inserted",
+                 "_resizing", "_executionCount", "_settingUp", "_slotCondition",
+                 "_provider", "_providerGeneration", "_global_slot_id", "__weakref__")
+
     loggerName = __name__ + '.Slot'
     logger = logging.getLogger(loggerName)
     traceLogger = logging.getLogger('TRACE.' + loggerName)
 
     _global_counter = itertools.count() # Allow slots to be sorted by their order of creation for debug output and diagramming purposes.
 
+    # changes whenever a slot is connected or disconnected,
+    # the cached providers of get() are only valid for one generation
+    _connectionCounter = itertools.count()
+    _connectionGeneration = _connectionCounter.next()
+
     @property
     def graph(self):
         return self.operator.graph
@@ -240,23 +359,26 @@ class Slot(object):
         self._stypeType = stype       # the slot type class
         self.stype = stype(self)      # the slot type instance
 
-        self._sig_changed = OrderedSignal()
-        self._sig_ready = OrderedSignal()
-        self._sig_unready = OrderedSignal()
-        self._sig_dirty = OrderedSignal()
-        self._sig_connect = OrderedSignal()
-        self._sig_disconnect = OrderedSignal()
-        self._sig_resize = OrderedSignal()
-        self._sig_resized = OrderedSignal()
-        self._sig_remove = OrderedSignal()
-        self._sig_removed = OrderedSignal()
-        self._sig_inserted = OrderedSignal()
+        # the signals are created when the first function subscribes
+        self._sig_changed = _noSignal
+        self._sig_ready = _noSignal
+        self._sig_unready = _noSignal
+        self._sig_dirty = _noSignal
+        self._sig_connect = _noSignal
+        self._sig_disconnect = _noSignal
+        self._sig_resize = _noSignal
+        self._sig_resized = _noSignal
+        self._sig_remove = _noSignal
+        self._sig_removed = _noSignal
+        self._sig_inserted = _noSignal
         
         self._resizing = False
         
         self._executionCount = 0
         self._settingUp = False
-        self._condition = threading.Condition()
+        self._slotCondition = None
+        self._provider = None         # the slot at the end of the partner chain, see get()
+        self._providerGeneration = -1
         
         self._global_slot_id = Slot._global_counter.next() # Allow slots to be sorted by their order of creation for debug output and diagramming purposes.
 
@@ -267,13 +389,30 @@ class Slot(object):
     #
 
 
+    @property
+    def _condition(self):
+        # only multi-slots that act as the operator of their
+        # sub-slots use the condition, see RequestExecutionWrapper
+        if self._slotCondition is None:
+            with _slotConditionLock:
+                if self._slotCondition is None:
+                    self._slotCondition = threading.Condition()
+        return self._slotCondition
+
+    def _subscribe(self, name, function, kwargs):
+        signal = getattr(self, name)
+        if signal is _noSignal:
+            signal = OrderedSignal()
+            setattr(self, name, signal)
+        signal.subscribe(function, **kwargs)
+
     def notifyDirty(self, function, **kwargs):
         """
         calls the corresponding function when the slot gets dirty
         first argument of the function is the slot, second argument the roi
         the keyword arguments follow
         """
-        self._sig_dirty.subscribe(function, **kwargs)
+        self._subscribe("_sig_dirty", function, kwargs)
 
 
     def notifyMetaChanged(self, function, **kwargs):
@@ -283,7 +422,7 @@ class Slot(object):
         the keyword arguments follow
         """
 
-        self._sig_changed.subscribe(function, **kwargs)
+        self._subscribe("_sig_changed", function, kwargs)
 
     def notifyReady(self, function, **kwargs):
         """
@@ -292,13 +431,13 @@ class Slot(object):
         first argument of the function is the slot
         the keyword arguments follow
         """
-        self._sig_ready.subscribe(function, **kwargs)
+        self._subscribe("_sig_ready", function, kwargs)
 
     def notifyUnready(self, function, **kwargs):
         """
         Subscribe to "unready" callbacks.  See notifyReady for details.
         """
-        self._sig_unready.subscribe(function, **kwargs)
+        self._subscribe("_sig_unready", function, kwargs)
 
     def _notifyConnect(self, function, **kwargs):
         """
@@ -306,7 +445,7 @@ class Slot(object):
         first argument of the function is the slot
         the keyword arguments follow
         """
-        self._sig_connect.subscribe(function, **kwargs)
+        self._subscribe("_sig_connect", function, kwargs)
 
     def notifyDisconnect(self, function, **kwargs):
         """
@@ -314,7 +453,7 @@ class Slot(object):
         first argument of the function is the slot
         the keyword arguments follow
         """
-        self._sig_disconnect.subscribe(function, **kwargs)
+        self._subscribe("_sig_disconnect", function, kwargs)
 
     def notifyResize(self, function, **kwargs):
         """
@@ -324,7 +463,7 @@ class Slot(object):
         argument is the new size
         the keyword arguments follow
         """
-        self._sig_resize.subscribe(function, **kwargs)
+        self._subscribe("_sig_resize", function, kwargs)
 
     def notifyResized(self, function, **kwargs):
         """
@@ -334,7 +473,7 @@ class Slot(object):
         argument is the new size
         the keyword arguments follow
         """
-        self._sig_resized.subscribe(function, **kwargs)
+        self._subscribe("_sig_resized", function, kwargs)
 
     def notifyRemove(self, function, **kwargs):
         """
@@ -344,7 +483,7 @@ class Slot(object):
         argument is the new size
         the keyword arguments follow
         """
-        self._sig_remove.subscribe(function, **kwargs)
+        self._subscribe("_sig_remove", function, kwargs)
 
     def notifyRemoved(self, function, **kwargs):
         """
@@ -354,7 +493,7 @@ class Slot(object):
         argument is the new size
         the keyword arguments follow
         """
-        self._sig_removed.subscribe(function, **kwargs)
+        self._subscribe("_sig_removed", function, kwargs)
 
     def notifyInserted(self, function, **kwargs):
         """
@@ -364,7 +503,7 @@ class Slot(object):
         argument is the new size
         the keyword arguments follow
         """
-        self._sig_inserted.subscribe(function, **kwargs)
+        self._subscribe("_sig_inserted", function, kwargs)
 
 
     def unregisterDirty(self, function):
@@ -453,6 +592,7 @@ class Slot(object):
             self._value = None
             if partner.level == self.level:
                 self.partner = partner
+                Slot._connectionChanged()
                 notifyReady = self.partner.meta._ready and not self.meta._ready
                 self.meta = self.partner.meta.copy()
 
@@ -483,6 +623,7 @@ class Slot(object):
 
             elif partner.level < self.level:
                 self.partner = partner
+                Slot._connectionChanged()
                 notifyReady = self.partner.meta._ready and not self.meta._ready
                 self.meta = self.partner.meta.copy()
                 for i, slot in enumerate(self._subSlots):
@@ -524,6 +665,8 @@ class Slot(object):
                 pass
         self.partner = None
         self._value = None
+        if had_partner:
+            Slot._connectionChanged()
         oldReady = self.meta._ready 
         self.meta = MetaDict()
 
@@ -656,25 +799,78 @@ class Slot(object):
             return ValueRequest(result)
         elif self.partner is not None:
             # this handles the case of an inputslot
-            # --> just relay the request
-            return self.partner.get(roi, destination)
+            # --> relay the request directly to the slot at
+            # the end of the partner chain
+            provider = self._provider
+            if self._providerGeneration != Slot._connectionGeneration or provider is None:
+                provider = self._resolveProvider()
+            return provider.get(roi, destination)
         else:
             # If someone is asking for data from an inputslot that has no value and no partner,
             #  then something is wrong.
             assert self._type != "input", "This inputSlot has no value and no partner.  You can't ask for its data yet!"
             # normal (outputslot) case
             # --> construct heavy request object..
+            graph = self.graph
+            operator = self.getRealOperator()
+            key = None
+            if isinstance(roi, rtype.SubRegion) and isinstance(self.stype, ArrayLike) and not operator.cheapExecute:
+                # share the execution with an identical request that is already in flight
+                key = (tuple(roi.start), tuple(roi.stop))
+                leader = graph._followInflightGet(self, key)
+                if leader is not None:
+                    following = [True] # the follower did not leave the leader yet
+                    request = Request( self._copyInflightResult, leader = leader, following = following, roi = roi, destination = destination )
+                    request.threadPool = graph.threadPool
+                    request.onCancel( graph._leaveInflightGet, leader = leader, following = following )
+                    return request
+
             execWrapper = Slot.RequestExecutionWrapper( self )
             request = Request( execWrapper, roi = roi, destination = destination )
+            if operator.executeInIOPool:
+                request.threadPool = ioThreadPool()
+            else:
+                # not the pool of the parent request, which
+                # may be the I/O pool of a reading operator
+                request.threadPool = graph.threadPool
+            request.cheap = operator.cheapExecute
+            if request.parent_request is None:
+                request.client = graph.client
+            if request.threadPool._groupWorkers is not None:
+                request.cpuGroup = operator._preferredCpuGroup()
+
+            if key is not None:
+                # register before the other cancel callbacks,
+                # the leader of followed requests must not be cancelled
+                graph._registerInflightGet(self, key, request)
+                request.onCancel( graph._cancelInflightGet, slot = self, key = key )
+                request.onFinish( graph._forgetInflightGet, slot = self, key = key )
 
             # We must decrement the execution count even if the request is cancelled
             request.onCancel( execWrapper._decrementOperatorExecutionCount )
+            request.onCancel( execWrapper._releaseMemory )
             return request
+
+    def _copyInflightResult(self, leader, following, roi, destination):
+        """
+        function of a request that waits for an identical request
+        (see Graph._followInflightGet) instead of executing the operator.
+        """
+        try:
+            result = leader.wait()
+            if destination is None:
+                destination = self.stype.allocateDestination(roi)
+            self.stype.copy_data(dst = destination, src = result)
+            return destination
+        finally:
+            self.graph._leaveInflightGet(None, leader, following)
             
     class RequestExecutionWrapper(object):
         def __init__(self, slot):
             self.started = False
             self.finished = False
+            self.followers = 0 # number of identical requests that wait for this execution
+            self.reservedBytes = 0 # bytes of the destination reserved in the memory budget
             self.slot = slot
             self.operator = slot.operator
             self.lock = threading.Lock()
@@ -683,30 +879,104 @@ class Slot(object):
             # store wether the user wants the results in a given destination area
             destination_given = False if (destination is None) else True
 
+            chunks = None
+            budget = global_memory_budget
+            limit = budget.limit # read once, setLimit() may change it concurrently
+            if limit is not None:
+                chunks = self._reserveMemory(budget, limit, roi, reserve = not destination_given)
             if destination is None:
+                # allocated after the split: the chunks are computed into views of
+                # the uninitialized destination, so its pages are only committed
+                # chunk by chunk
                 destination = self.slot.stype.allocateDestination(roi)
 
+            try:
+                # We are executing the operator.
+                # Incremement the execution count to protect against simultaneous setupOutputs() calls.
+                self._incrementOperatorExecutionCount()
 
-            # We are executing the operator.
-            # Incremement the execution count to protect against simultaneous setupOutputs() calls.
-            self._incrementOperatorExecutionCount()
-            
-            # Execute the workload, which might not ever return (if we get cancelled).
-            result_op = self.operator.execute(self.slot, (), roi, destination)
-            
-            # copy data from result_op to destination, if destinatino was actually given by the user, and the returned result_op is different from destination. (but don't copy if result_op is None, this means legacy op which wrote into destination anyway)
-            if destination_given and result_op is not None and id(result_op) != id(destination):
-                self.slot.stype.copy_data(dst = destination, src = result_op)
-            elif result_op is not None:
-                # FIXME: this should be moved to a isCompatible check in stypes.py
-                if hasattr(result_op, "shape"):
-                    assert result_op.shape == destination.shape, " ERROR: Operator %r has failed to provide a result of correct shape. result shape is %r vs %r.  roi was %r" % (self.operator,result_op.shape, destination.shape, str(roi) )
-                destination = result_op
-                
-            # Decrement the execution count
-            self._decrementOperatorExecutionCount()
+                if chunks is None:
+                    # Execute the workload, which might not ever return (if we get cancelled).
+                    result_op = self.operator.execute(self.slot, (), roi, destination)
+                else:
+                    # the roi does not fit into the memory budget:
+                    # compute it chunk by chunk into views of the destination,
+                    # so that the requests of the operator only need the memory
+                    # of one chunk
+                    for chunk in chunks:
+                        chunk_destination = destination[roiToSlice(chunk.start - roi.start, chunk.stop - roi.start)]
+                        chunk_result = self.operator.execute(self.slot, (), chunk, chunk_destination)
+                        if chunk_result is not None and id(chunk_result) != id(chunk_destination):
+                            self.slot.stype.copy_data(dst = chunk_destination, src = chunk_result)
+                    result_op = destination
+
+                # copy data from result_op to destination, if destinatino was actually given by the user, and the returned result_op is different from destination. (but don't copy if result_op is None, this means legacy op which wrote into destination anyway)
+                if destination_given and result_op is not None and id(result_op) != id(destination):
+                    self.slot.stype.copy_data(dst = destination, src = result_op)
+                elif result_op is not None:
+                    # FIXME: this should be moved to a isCompatible check in stypes.py
+                    if hasattr(result_op, "shape"):
+                        assert result_op.shape == destination.shape, " ERROR: Operator %r has failed to provide a result of correct shape. result shape is %r vs %r.  roi was %r" % (self.operator,result_op.shape, destination.shape, str(roi) )
+                    destination = result_op
+
+                # Decrement the execution count
+                self._decrementOperatorExecutionCount()
+            finally:
+                self._releaseMemory()
             return destination
 
+        def _reserveMemory(self, budget, limit, roi, reserve = True):
+            """
+            reserve the bytes of the destination of the roi in the budget,
+            unless reserve is False because the caller supplied the destination.
+            Only top level requests wait for the budget, their child requests
+            are just counted.
+
+            returns the chunks of a top level roi that is larger than the
+            limit and can be split, None otherwise.
+            """
+            nbytes = self.slot.stype.destinationSize(roi)
+            if nbytes == 0:
+                return None
+            request = threading.current_thread().current_request
+            toplevel = request is None or request.parent_request is None
+            if reserve:
+                budget.reserve(nbytes, block = toplevel)
+                with self.lock:
+                    self.reservedBytes = nbytes
+            if not toplevel or nbytes <= limit or not isinstance(roi, rtype.SubRegion):
+                return None
+            return self._splitRoi(roi, nbytes, limit / 2)
+
+        def _splitRoi(self, roi, nbytes, chunkBytes):
+            """
+            split the roi along its first axis with an extent larger
+            than one into chunks of at most chunkBytes, if possible.
+            """
+            shape = roi.stop - roi.start
+            for axis, extent in enumerate(shape):
+                if extent > 1:
+                    break
+            else:
+                return None
+            step = max(1, extent * chunkBytes // nbytes)
+            chunks = []
+            for begin in range(roi.start[axis], roi.stop[axis], step):
+                start = list(roi.start)
+                stop = list(roi.stop)
+                start[axis] = begin
+                stop[axis] = min(begin + step, roi.stop[axis])
+                chunks.append(rtype.SubRegion(roi.slot, start, stop))
+            return chunks
+
+        def _releaseMemory(self, *args):
+            # Called when the execution returns and when the request is cancelled
+            with self.lock:
+                nbytes = self.reservedBytes
+                self.reservedBytes = 0
+            if nbytes > 0:
+                global_memory_budget.release(nbytes)
+
         def _incrementOperatorExecutionCount(self):
             self.started = True
             assert self.operator._executionCount >= 0, "BUG: How did the execution count get negative?"
@@ -730,6 +1000,26 @@ class Slot(object):
                         self.operator._condition.notifyAll()
 
 
+    def _resolveProvider(self):
+        """
+        Find and cache the slot whose get() provides the data of
+        this slot: the last slot of the partner chain, or a slot
+        of a subclass that overrides get().
+        """
+        # read the generation first, a concurrent connect invalidates the result
+        generation = Slot._connectionGeneration
+        provider = self.partner
+        while provider._value is None and provider.partner is not None \
+                and type(provider).get.im_func is Slot.get.im_func:
+            provider = provider.partner
+        self._provider = provider
+        self._providerGeneration = generation
+        return provider
+
+    @staticmethod
+    def _connectionChanged():
+        Slot._connectionGeneration = Slot._connectionCounter.next()
+
     def setDirty(self, *args,**kwargs):
         """
         this method is called by a partnering OutputSlot
@@ -737,6 +1027,9 @@ class Slot(object):
 
         the key parameter identifies the changed region
         of an numpy.ndarray
+
+        inside of a graph.batch() the notification is
+        deferred until the batch ends.
         """
         assert self.operator is not None, \
                "Slot '%s' cannot be set dirty, slot not belonging to any actual operator instance" % self.name
@@ -746,14 +1039,24 @@ class Slot(object):
             else:
                 roi = args[0]
 
-            for c in self.partners:
-                c.setDirty(roi)
+            graph = self.graph
+            if graph._batchDepth > 0 and graph._deferDirty(self, roi):
+                return
+            self._propagateDirty(roi)
+
+    def _propagateDirty(self, roi):
+        if self._type == "output":
+            # requests that are in flight now may compute outdated data
+            self.graph._forgetInflightGets(self)
+
+        for c in self.partners:
+            c.setDirty(roi)
 
-            # call callbacks
-            self._sig_dirty(self, roi)
+        # call callbacks
+        self._sig_dirty(self, roi)
 
-            if self._type == "input" and self.operator.configured():
-                self.operator.propagateDirty(self, (), roi)
+        if self._type == "input" and self.operator.configured():
+            self.operator.propagateDirty(self, (), roi)
 
     def __iter__(self):
         assert self.level >= 1
@@ -1047,6 +1350,8 @@ class Slot(object):
         if self.operator is not None:
             # check wether all slots are connected and notify operator
             if self.operator.configured():
+                if isinstance(self.operator, Operator) and self.operator.graph._deferSetup(self.operator):
+                    return
                 self.operator._setupOutputs()
 
     def _requiredLength(self):
@@ -1151,6 +1456,7 @@ class InputSlot(Slot):
     operator (i.e. .connect(partner) call) or allows
     to directly provide a value as input (i.e. .setValue(value) call)
     """
+    __slots__ = ()
 
     def __init__(self, name = "", operator = None, stype = ArrayLike, rtype=rtype.SubRegion, value = None, optional = False, level = 0):
         super(InputSlot, self).__init__(name = name, operator = operator, stype = stype, rtype=rtype, value = value, optional = optional, level = level)
@@ -1173,7 +1479,7 @@ class OutputSlot(Slot):
 
     this call returns an GetItemRequestObject.
     """
-
+    __slots__ = ()
 
     def __init__(self, name = "", operator = None, stype = ArrayLike, rtype = rtype.SubRegion, value = None, optional = False, level = 0):
         super(OutputSlot, self).__init__(name = name, operator = operator, stype = stype, rtype=rtype, level = level)
@@ -1376,7 +1682,7 @@ class Operator(object):
 
 
         self._initialized = True
-        if self.configured():
+        if self.configured() and not self.graph._deferSetup(self):
             self._setupOutputs()
 
     def _instantiate_slots(self):
@@ -1498,6 +1804,57 @@ class Operator(object):
         wrapper.__wrapped__ = func # Emulate python 3 behavior of @wraps
         return wrapper
 
+    # Set this to True in operators whose execute() only relays, slices or
+    # copies the data of their inputs. Identical requests of their outputs
+    # are not coalesced (see Slot.get), the requests of the operators that
+    # do the actual work are. A queued request of such an operator is
+    # executed inline when the request that created it waits for it.
+    cheapExecute = False
+
+    # Set this to True in operators whose execute() hands CPU bound
+    # python code to computeInProcess(), to run it in a worker process
+    # instead of the calling thread.
+    executeInProcess = False
+
+    # Set this to True in operators whose execute() mostly waits for
+    # blocking reads (files, network), their requests are executed by
+    # the I/O thread pool (see request.ioThreadPool) instead of the
+    # workers of the graph.
+    executeInIOPool = False
+
+    # Index of the cpu group (see lazyflow.affinity) whose memory holds
+    # the data of the operator, set e.g. by caches when they allocate
+    # their storage. If the thread pool pins its workers, the requests
+    # of the operator and of the operators that read its outputs are
+    # preferably executed by workers of that group.
+    cpuGroup = None
+
+    def _preferredCpuGroup(self):
+        if self.cpuGroup is not None:
+            return self.cpuGroup
+        for slot in self.inputs.values():
+            if slot.partner is not None:
+                partnerOp = slot.partner.getRealOperator()
+                if partnerOp is not None and partnerOp.cpuGroup is not None:
+                    return partnerOp.cpuGroup
+        return None
+
+    def computeInProcess(self, func, args, result):
+        """
+        Compute func(*args) and write the returned array into result.
+
+        func must be a module level function and args must be picklable.
+        If the executeInProcess flag of the operator is set, the computation
+        is done by the global process pool (see lazyflow.processpool),
+        otherwise it runs in the calling thread.
+        Returns result.
+        """
+        if self.executeInProcess:
+            from lazyflow.processpool import global_process_pool
+            return global_process_pool.compute(func, args, result)
+        result[...] = func(*args)
+        return result
+
     def _setupOutputs(self):
         with Tracer(self.traceLogger, msg=self.name):
             # Don't setup this operator if there are currently requests on it.
@@ -1512,8 +1869,14 @@ class Operator(object):
                 for k, oslot in self.outputs.items():
                     readyFlags[k] = oslot.meta._ready
                 
-                # Call the subclass
-                self.setupOutputs()
+                # Call the subclass, the sub-graph it builds
+                # is configured immediately (see Graph.transaction)
+                local = self.graph._local
+                local.setupDepth = getattr(local, "setupDepth", 0) + 1
+                try:
+                    self.setupOutputs()
+                finally:
+                    local.setupDepth -= 1
         
                 self._settingUp = False
                 self._condition.notifyAll()
@@ -1778,12 +2141,322 @@ class OperatorWrapper(Operator):
         # Calls to Slot.setitem are already forwarded to all slot partners.
         pass
 
-class Graph(object):    
+def _upstreamOperators(operator):
+    """
+    Return the operators that provide the data of the inputs of
+    operator and of its outputs that are connected to inner operators.
+    """
+    result = []
+    slots = operator.inputs.values() + operator.outputs.values()
+    while len(slots) > 0:
+        slot = slots.pop()
+        slots.extend(slot._subSlots)
+        if slot.partner is not None:
+            upstream = slot.partner.getRealOperator()
+            if upstream is not None:
+                result.append(upstream)
+    return result
+
+def _topologicalOrder(operators):
+    """
+    Sort the operators so that every operator comes after the
+    operators it depends on, cycles are broken arbitrarily.
+    """
+    pending = set(operators)
+    visited = set()
+    order = []
+    for root in operators:
+        if root in visited:
+            continue
+        visited.add(root)
+        # depth first search without recursion, deep graphs exceed the recursion limit
+        stack = [(root, iter(_upstreamOperators(root)))]
+        while len(stack) > 0:
+            operator, upstream = stack[-1]
+            for up in upstream:
+                if up not in visited:
+                    visited.add(up)
+                    stack.append((up, iter(_upstreamOperators(up))))
+                    break
+            else:
+                stack.pop()
+                if operator in pending:
+                    order.append(operator)
+    return order
+
+def _mergeDirtyRoi(rois, roi):
+    """
+    Add roi to the list of dirty rois of a slot. A SubRegion is merged
+    with an already collected one if their union is a box again, i.e.
+    if one contains the other or if they only differ along one axis and
+    overlap or touch there. Other SubRegions are kept separately, so
+    that no clean data is invalidated.
+    """
+    if isinstance(roi, rtype.Everything):
+        del rois[:]
+        rois.append(roi)
+        return
+    for other in rois:
+        if isinstance(other, rtype.Everything):
+            return
+    if not isinstance(roi, rtype.SubRegion):
+        rois.append(roi)
+        return
+    start, stop = list(roi.start), list(roi.stop)
+    merged = False
+    position = len(rois) # the merged roi takes the place of the first merged entry
+    i = 0
+    while i < len(rois):
+        other = rois[i]
+        if isinstance(other, rtype.SubRegion) and len(other.start) == len(start) \
+                and _unionIsBox(start, stop, list(other.start), list(other.stop)):
+            start = map(min, start, other.start)
+            stop = map(max, stop, other.stop)
+            merged = True
+            position = min(position, i)
+            del rois[i]
+            # the grown region may be mergeable with regions that were checked before
+            i = 0
+        else:
+            i += 1
+    if merged:
+        roi = rtype.SubRegion(roi.slot, start = start, stop = stop)
+    rois.insert(min(position, len(rois)), roi)
+
+def _unionIsBox(start, stop, otherStart, otherStop):
+    """
+    Return True if the union of the boxes [start, stop) and
+    [otherStart, otherStop) is their bounding box.
+    """
+    if all(c <= a and b <= d for a, b, c, d in zip(start, stop, otherStart, otherStop)) or \
+       all(a <= c and d <= b for a, b, c, d in zip(start, stop, otherStart, otherStop)):
+        return True
+    differing = [k for k in range(len(start))
+                 if start[k] != otherStart[k] or stop[k] != otherStop[k]]
+    if len(differing) != 1:
+        return False
+    k = differing[0]
+    return start[k] <= otherStop[k] and otherStart[k] <= stop[k]
+
+
+class Graph(object):
+    _threadPool = None
+    client = None
+    _batchDepth = 0 # number of open batches in all threads
+    _configDepth = 0 # number of open transactions in all threads
+
+    def __init__(self, numThreads = None, client = None, affinity = None):
+        """
+        Arguments:
+          numThreads : if given, the graph owns a separate ThreadPool with this
+                       number of workers that executes all requests of its operators.
+                       Otherwise the requests are executed by the global ThreadPool.
+          client     : client tag of the top level requests of the graph, graphs
+                       with different tags share the workers of a ThreadPool
+                       fairly (see ThreadPool.setClientWeight)
+          affinity   : affinity mode of the workers of the separate ThreadPool
+                       ("cores" or "groups", see ThreadPool)
+        """
+        self.client = client
+        self._threadPool = None
+        if numThreads is not None:
+            self._threadPool = ThreadPool(numThreads, affinity = affinity)
+        # requests of output slots that are not finished yet,
+        # slot -> {(roi start, roi stop) : request}
+        self._inflightGets = {}
+        self._inflightLock = threading.Lock()
+        self._depthLock = threading.Lock()
+        # the open batches and transactions of a thread only defer the
+        # dirty notifications and setupOutputs calls of that thread:
+        #   batchDepth     : number of nested batches
+        #   dirty          : slot -> list of dirty rois
+        #   configDepth    : number of nested transactions
+        #   setupDepth     : number of running setupOutputs calls
+        #   deferredSetups : operators whose setupOutputs is deferred -> None
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer the dirty notifications of the slots of the graph:
+
+        with graph.batch():
+            for segment in stroke:
+                opLabels.Input[segment] = labels
+
+        The dirty rois of every slot are collected, SubRegions whose
+        union is a box are merged, and each slot propagates its rois
+        once when the outermost batch ends. Batches can be nested.
+        A batch only defers the notifications of the thread that
+        opened it.
+        """
+        local = self._local
+        depth = getattr(local, "batchDepth", 0)
+        if depth == 0:
+            local.dirty = collections.OrderedDict()
+        local.batchDepth = depth + 1
+        with self._depthLock:
+            self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            with self._depthLock:
+                self._batchDepth -= 1
+            local.batchDepth -= 1
+            dirty = None
+            if local.batchDepth == 0:
+                dirty = local.dirty
+                local.dirty = None
+            if dirty:
+                for slot, rois in dirty.items():
+                    for roi in rois:
+                        slot._propagateDirty(roi)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Configuration transaction: defer the setupOutputs calls of
+        the operators of the graph.
+
+        with graph.transaction():
+            for lane in lanes:
+                lane.Input.connect(...)
+                lane.Parameter.setValue(...)
+
+        Operators whose inputs change inside of the transaction are
+        only recorded. When the outermost transaction ends they are
+        set up once each, every operator after the operators it
+        depends on. The setupOutputs of an operator builds and
+        configures its internal sub-graph immediately as usual.
+
+        Note that the meta data of the outputs of the recorded
+        operators is not updated before the transaction ends.
+        A transaction only defers the setupOutputs calls of the
+        thread that opened it.
+        """
+        local = self._local
+        depth = getattr(local, "configDepth", 0)
+        if depth == 0:
+            local.deferredSetups = collections.OrderedDict()
+        local.configDepth = depth + 1
+        with self._depthLock:
+            self._configDepth += 1
+        try:
+            yield self
+        finally:
+            try:
+                if local.configDepth == 1:
+                    self._setupDeferredOperators(local)
+            finally:
+                local.configDepth -= 1
+                with self._depthLock:
+                    self._configDepth -= 1
+                if local.configDepth == 0:
+                    local.deferredSetups = None
+
+    def _deferSetup(self, operator):
+        """
+        Record operator for the end of the transaction of the calling
+        thread, returns False if its setupOutputs has to be called immediately.
+        """
+        if self._configDepth == 0:
+            return False
+        local = self._local
+        if getattr(local, "configDepth", 0) == 0 or getattr(local, "setupDepth", 0) > 0:
+            return False
+        local.deferredSetups[operator] = None
+        return True
+
+    def _setupDeferredOperators(self, local):
+        while len(local.deferredSetups) > 0:
+            # operators that are set up now record their consumers
+            # for the next round
+            operators = _topologicalOrder(local.deferredSetups.keys())
+            local.deferredSetups = collections.OrderedDict()
+            for operator in operators:
+                local.deferredSetups.pop(operator, None)
+                if operator.configured():
+                    operator._setupOutputs()
+
+    def _deferDirty(self, slot, roi):
+        """
+        Collect the dirty roi of slot, returns False if the
+        calling thread has no open batch.
+        """
+        local = self._local
+        if getattr(local, "batchDepth", 0) == 0:
+            return False
+        rois = local.dirty.get(slot)
+        if rois is None:
+            rois = local.dirty[slot] = []
+        _mergeDirtyRoi(rois, roi)
+        return True
+
+    @property
+    def threadPool(self):
+        if self._threadPool is not None:
+            return self._threadPool
+        return global_thread_pool
+
+    def _followInflightGet(self, slot, key):
+        """
+        Return the request that already computes the roi key of slot, or
+        None. The returned request will not be cancelled until all of its
+        followers called _leaveInflightGet.
+        """
+        with self._inflightLock:
+            requests = self._inflightGets.get(slot)
+            if requests is None:
+                return None
+            leader = requests.get(key)
+            if leader is None or leader.canceled:
+                return None
+            leader.function.followers += 1
+            return leader
+
+    def _registerInflightGet(self, slot, key, request):
+        with self._inflightLock:
+            requests = self._inflightGets.get(slot)
+            if requests is None:
+                # weak values: requests that are never executed are simply forgotten
+                requests = self._inflightGets[slot] = weakref.WeakValueDictionary()
+            requests.setdefault(key, request)
+
+    def _forgetInflightGet(self, request, slot, key):
+        with self._inflightLock:
+            requests = self._inflightGets.get(slot)
+            if requests is not None and requests.get(key) is request:
+                del requests[key]
+                if len(requests) == 0:
+                    del self._inflightGets[slot]
+
+    def _forgetInflightGets(self, slot):
+        with self._inflightLock:
+            self._inflightGets.pop(slot, None)
+
+    def _cancelInflightGet(self, request, slot, key):
+        # onCancel callback of a registered request,
+        # refuse the cancellation while other requests wait for the result
+        with self._inflightLock:
+            if request.function.followers > 0:
+                return False
+        self._forgetInflightGet(request, slot, key)
+        return True
+
+    def _leaveInflightGet(self, request, leader, following):
+        # called when a request that follows leader is finished or canceled
+        with self._inflightLock:
+            if following[0]:
+                following[0] = False
+                leader.function.followers -= 1
+        return True
+
     def stopGraph(self):
         pass
 
     def finalize(self):
-        pass
+        if self._threadPool is not None:
+            self._threadPool.stopThreadPool()
 
     def resumeGraph(self):
         pass
@@ -138,6 +138,7 @@ class OpStackLoader(Operator):
                      ['/a/b/c.txt', '/d/e/f.txt', '../g/i/h.txt']
     """
     name = "Image Stack Reader"
+    executeInIOPool = True
     category = "Input"
 
     inputSlots = [InputSlot("globstring", stype = "string")]
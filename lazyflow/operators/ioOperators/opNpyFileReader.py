@@ -7,6 +7,7 @@ import copy
 class OpNpyFileReader(Operator):
     name = "OpNpyFileReader"
     category = "Input"
+    executeInIOPool = True # the file is memory mapped
 
     FileName = InputSlot(stype='filestring')
 
@@ -7,6 +7,7 @@ class OpStreamingHdf5Reader(Operator):
     """
     name = "OpStreamingHdf5Reader"
     category = "Reader"
+    executeInIOPool = True
 
     # The project hdf5 File object (already opened)
     Hdf5File = InputSlot(stype='hdf5File')
@@ -301,9 +301,35 @@ class OpPredictRandomForest(Operator):
             self.outputs["PMaps"].setDirty(slice(None,None,None))
 
 
+def _segmentation(img):
+    """
+    index of the highest probability class for each pixel,
+    computed by OpSegmentation in a worker process
+    """
+    stop = img.size
+
+    seg = []
+
+    for i in range(0,stop,img.shape[-1]):
+        curr_prob = -1
+        highest_class = -1
+        for c in range(img.shape[-1]):
+            prob = img.ravel()[i+c]
+            if prob > curr_prob:
+                curr_prob = prob
+                highest_class = c
+        assert highest_class != -1, "OpSegmentation: Strange classes/probabilities"
+
+        seg.append(highest_class)
+
+    seg = numpy.array(seg)
+    seg.resize(img.shape[:-1])
+    return seg
+
 class OpSegmentation(Operator):
     name = "OpSegmentation"
     description = "displaying highest probability class for each pixel"
+    executeInProcess = True
 
     inputSlots = [InputSlot("Input")]
     outputSlots = [OutputSlot("Output")]
@@ -327,26 +353,8 @@ class OpSegmentation(Operator):
         rkey = roiToSlice(rstart,rstop)
         img = self.inputs["Input"][rkey].allocate().wait()
 
-        stop = img.size
-
-        seg = []
-
-        for i in range(0,stop,img.shape[-1]):
-            curr_prob = -1
-            highest_class = -1
-            for c in range(img.shape[-1]):
-                prob = img.ravel()[i+c]
-                if prob > curr_prob:
-                    curr_prob = prob
-                    highest_class = c
-            assert highest_class != -1, "OpSegmentation: Strange classes/probabilities"
-
-            seg.append(highest_class)
-
-        seg = numpy.array(seg)
-        seg.resize(img.shape[:-1])
-
-        return seg[:]
+        seg = numpy.ndarray(img.shape[:-1], dtype=int)
+        return self.computeInProcess(_segmentation, (img,), seg)
 
 
 
@@ -363,9 +371,24 @@ class OpSegmentation(Operator):
         return self.outputs["Output"].meta.dtype
 
 
+def _areas(img, numC):
+    """
+    number of pixels of each class,
+    computed by OpAreas in a worker process
+    """
+    areas = []
+    for i in range(numC):
+        areas.append(0)
+
+    for i in img.flat:
+        areas[int(i)] +=1
+
+    return areas
+
 class OpAreas(Operator):
     name = "OpAreas"
     description = "counting pixel areas"
+    executeInProcess = True
 
     inputSlots = [InputSlot("Input"), InputSlot("NumberOfChannels")]
     outputSlots = [OutputSlot("Areas")]
@@ -379,14 +402,8 @@ class OpAreas(Operator):
 
         numC = self.inputs["NumberOfChannels"].value
 
-        areas = []
-        for i in range(numC):
-            areas.append(0)
-
-        for i in img.flat:
-            areas[int(i)] +=1
-
-        return numpy.array(areas)
+        areas = numpy.ndarray((numC,), dtype=int)
+        return self.computeInProcess(_areas, (img, numC), areas)
 
 
 
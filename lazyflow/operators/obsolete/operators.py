@@ -44,6 +44,7 @@ from lazyflow.tracer import Tracer
 class OpArrayPiper(Operator):
     name = "ArrayPiper"
     description = "simple piping operator"
+    cheapExecute = True
 
     inputSlots = [InputSlot("Input")]
     outputSlots = [OutputSlot("Output")]
@@ -187,6 +188,7 @@ class OpRequestSplitter(OpArrayPiper):
     name = "RequestSplitter"
     description = "split requests into two parts along longest axis"
     category = "misc"
+    cheapExecute = False
 
     def execute(self, slot, subindex, roi, result):
         key = roiToSlice(roi.start,roi.stop)
@@ -321,6 +323,7 @@ class OpArrayCache(OpArrayPiper):
     name = "ArrayCache"
     description = "numpy.ndarray caching class"
     category = "misc"
+    cheapExecute = False
 
     inputSlots = [InputSlot("Input"), InputSlot("blockShape", value = 64), InputSlot("fixAtCurrent", value = False)]
     outputSlots = [OutputSlot("Output")]
@@ -353,6 +356,7 @@ class OpArrayCache(OpArrayPiper):
             self._has_fixed_dirty_blocks = False
             self._memory_manager = ArrayCacheMemoryMgr.instance
             self._running = 0
+            self._fetchWaiters = {} # input request -> number of executions that wait for it besides its own
             #lazyflow.verboseMemory = True
 
     def _memorySize(self):
@@ -439,6 +443,8 @@ class OpArrayCache(OpArrayPiper):
                 if self._blockState is None:
                     self._allocateManagementStructures()
                 self._cache = mem
+                # the pages of the cache are local to the allocating worker
+                self.cpuGroup = getattr(current_thread(), "cpuGroup", None)
             self._memory_manager.add(self)
             self._cacheLock.release()
 
@@ -530,8 +536,26 @@ class OpArrayCache(OpArrayPiper):
         
 
 
+    # number of times an execution requests the blocks of canceled input
+    # requests again, before it reads its roi directly from the input
+    maxCancelRetries = 8
+
     def execute(self, slot, subindex, roi, result):
-        #return
+        cur_req = getattr(current_thread(), "current_request", None)
+        for attempt in range(self.maxCancelRetries):
+            if self._executeOnce(roi, result, cur_req):
+                return
+            if cur_req is not None and cur_req.canceled:
+                # the request of this execution was canceled as well
+                return
+        self.inputs["Input"][roi.toSlice()].writeInto(result).wait()
+
+    def _executeOnce(self, roi, result, cur_req):
+        """
+        Copy the roi from the cache into result, after the dirty blocks
+        are requested from the input. Returns False if some of the blocks
+        were not computed because their input requests were canceled.
+        """
         key = roi.toSlice()
 
         start, stop = sliceToRoi(key, self.shape)
@@ -569,9 +593,16 @@ class OpArrayCache(OpArrayPiper):
                 self._memory_manager.add(self)
             cacheView = None
             self._lock.release()
-            return
+            return True
 
-        inProcessQueries = numpy.unique(numpy.extract( blockSet == OpArrayCache.IN_PROCESS, self._blockQuery[blockKey]))
+        # the input requests of other executions that this execution waits for,
+        # they are not canceled together with the execution that created them
+        execution = {"running" : True, "waitsFor" : []}
+        for query in numpy.unique(numpy.extract( blockSet == OpArrayCache.IN_PROCESS, self._blockQuery[blockKey])):
+            req = query() # get original req object from weakref
+            if req is not None:
+                execution["waitsFor"].append(req)
+                self._fetchWaiters[req] = self._fetchWaiters.get(req, 0) + 1
 
         cond = (blockSet == OpArrayCache.DIRTY)
         tileWeights = fastWhere(cond, 1, 128**3, numpy.uint32)
@@ -582,9 +613,19 @@ class OpArrayCache(OpArrayPiper):
         dirtyRois = []
         half = tileArray.shape[0]/2
         dirtyPool = request.Pool()
+        fetches = []
 
-        def onCancel(req):
-            return False # indicate that this request cannot be canceled
+        def onCancel(req, key2):
+            with self._lock:
+                shared = self._fetchWaiters.get(req, 0) > 0
+                if not shared and self._blockQuery is not None:
+                    # the blocks of a canceled input request must be requested again
+                    self._resetBlocks(req, key2)
+            if shared:
+                # other executions wait for the blocks: let the input request
+                # finish, its blocks are clean then
+                req.onFinish(self._fetchFinished, key2 = key2)
+                return False
 
         self.traceLogger.debug("Creating cache input requests")
         for i in range(tileArray.shape[1]):
@@ -609,8 +650,9 @@ class OpArrayCache(OpArrayPiper):
 
                 req = self.inputs["Input"][key].writeInto(self._cache[key])
 
-                req.onCancel(onCancel)
+                req.onCancel(onCancel, key2 = key2)
                 dirtyPool.add(req)
+                fetches.append((req, key2))
 
                 self._blockQuery[key2] = weakref.ref(req)
 
@@ -638,6 +680,10 @@ class OpArrayCache(OpArrayPiper):
             self._has_fixed_dirty_blocks = True
         self._lock.release()
 
+        # if the request of this execution is canceled, it is never resumed
+        if cur_req is not None:
+            cur_req.onCancel(self._executionCanceled, execution = execution)
+
         temp = itertools.count(0)
 
         #wait for all requests to finish
@@ -647,22 +693,37 @@ class OpArrayCache(OpArrayPiper):
         self.traceLogger.debug( "All cache input requests received." )
 
         # indicate the finished inprocess state (i.e. CLEAN)
+        canceledFetches = [key2 for req, key2 in fetches if req.canceled]
         if not self._fixed and temp.next() == 0:
             with self._lock:
-                blockSet[:] = fastWhere(cond, OpArrayCache.CLEAN, blockSet, numpy.uint8)
-                self._blockQuery[blockKey] = fastWhere(cond, None, self._blockQuery[blockKey], object)
+                if len(canceledFetches) == 0:
+                    blockSet[:] = fastWhere(cond, OpArrayCache.CLEAN, blockSet, numpy.uint8)
+                    self._blockQuery[blockKey] = fastWhere(cond, None, self._blockQuery[blockKey], object)
+                else:
+                    for req, key2 in fetches:
+                        if not req.canceled:
+                            self._blockState[key2] = OpArrayCache.CLEAN
+                            self._blockQuery[key2] = None
 
 
         inProcessPool = request.Pool()
         #wait for all in process queries
-        for req in inProcessQueries:
-            req = req() # get original req object from weakref
-            if req is not None:
-                inProcessPool.add(req) 
+        for req in execution["waitsFor"]:
+            inProcessPool.add(req)
 
         inProcessPool.wait()
+        canceled = len(canceledFetches) > 0 or any(req.canceled for req in inProcessPool.requests)
         inProcessPool.clean()
 
+        if canceled:
+            # some of the blocks were not computed, because their
+            # input requests were canceled: start over, unless this
+            # execution is canceled as well
+            with self._lock:
+                self._stopExecution(execution)
+            cacheView = None
+            return False
+
         # finally, store results in result area
         self._lock.acquire()
         if self._cache is not None:
@@ -671,13 +732,54 @@ class OpArrayCache(OpArrayPiper):
             self.traceLogger.debug( "WAITING FOR INPUT WITH THE CACHE LOCK LOCKED!" )
             self.inputs["Input"][roiToSlice(start, stop)].writeInto(result).wait()
             self.traceLogger.debug( "INPUT RECEIVED WITH THE CACHE LOCK LOCKED." )
-        self._running -= 1
-        self._updatePriority()
-        if self._running == 0:
-            self._memory_manager.add(self)
+        self._stopExecution(execution)
         cacheView = None
 
         self._lock.release()
+        return True
+
+    def _stopExecution(self, execution):
+        # must be called with self._lock held
+        if execution["running"]:
+            execution["running"] = False
+            for req in execution["waitsFor"]:
+                waiters = self._fetchWaiters.pop(req) - 1
+                if waiters > 0:
+                    self._fetchWaiters[req] = waiters
+            self._running -= 1
+            self._updatePriority()
+            if self._running == 0:
+                self._memory_manager.add(self)
+
+    def _executionCanceled(self, req, execution):
+        # onCancel callback of the request that executes
+        with self._lock:
+            self._stopExecution(execution)
+
+    def _resetBlocks(self, req, key2):
+        # must be called with self._lock held
+        # reset the blocks that wait for the canceled input request req to DIRTY
+        blockState = self._blockState[key2]
+        blockQuery = self._blockQuery[key2]
+        for index in numpy.ndindex(*blockQuery.shape):
+            query = blockQuery[index]
+            if query is not None and query() is req:
+                blockState[index] = OpArrayCache.DIRTY
+                blockQuery[index] = None
+
+    def _fetchFinished(self, req, key2):
+        # onFinish callback of an input request whose cancellation was refused,
+        # its execution is not resumed to mark its blocks as clean
+        with self._lock:
+            if self._blockQuery is None:
+                return
+            blockState = self._blockState[key2]
+            blockQuery = self._blockQuery[key2]
+            for index in numpy.ndindex(*blockQuery.shape):
+                query = blockQuery[index]
+                if query is not None and query() is req:
+                    blockState[index] = OpArrayCache.CLEAN
+                    blockQuery[index] = None
 
     def setInSlot(self, slot, subindex, roi, value):
         assert slot == self.inputs["Input"]
@@ -398,8 +398,7 @@ class OpPixelFeaturesPresmoothed(Operator):
             req = self.inputs["Input"][treadKey].allocate()
 
             sourceArray = req.wait()
-            req.result = None
-            req.destination = None
+            req.clean()
             if sourceArray.dtype != numpy.float32:
                 sourceArrayF = sourceArray.astype(numpy.float32)
                 sourceArray.resize((1,), refcheck = False)
@@ -532,6 +531,7 @@ class OpBaseVigraFilter(OpArrayPiper):
     outputSlots = [OutputSlot("Output")]
 
     name = "OpBaseVigraFilter"
+    cheapExecute = False
     category = "Vigra filter"
 
     vigraFilter = None
@@ -908,6 +908,7 @@ class OpLaplacianOfGaussian(OpBaseVigraFilter):
 class OpImageReader(Operator):
     name = "Image Reader"
     category = "Input"
+    executeInIOPool = True
 
     inputSlots = [InputSlot("Filename", stype = "filestring")]
     outputSlots = [OutputSlot("Image")]
@@ -1062,30 +1063,10 @@ class OpH5WriterBigDataset(Operator):
 
         # Throttle: Only allow 10 outstanding requests at a time.
         # Otherwise, the whole set of requests can be outstanding and use up ridiculous amounts of memory.        
-        activeRequests = deque()
-        activeSlicings = deque()
-        # Start by activating 10 requests 
-        for i in range( min(10, len(slicings)) ):
-            s = slicings.pop()
-            activeSlicings.append(s)
-            logger.debug( "Creating request for slicing {}".format(s) )
-            activeRequests.append( self.inputs["Image"][s] )
-        
         counter = 0
-
-        while len(activeRequests) > 0:
-            # Wait for a request to finish
-            req = activeRequests.popleft()
-            s=activeSlicings.popleft()
-            data = req.wait()
+        for s, data in Pool.imap(lambda s: imSlot[s], slicings, max_in_flight = 10):
             self.d[s]=data
 
-            if len(slicings) > 0:
-                # Create a new active request
-                s = slicings.pop()
-                activeSlicings.append(s)
-                activeRequests.append( self.inputs["Image"][s] )
-            
             # Since requests finish in an arbitrary order (but we always block for them in the same order),
             # this progress feedback will not be smooth.  It's the best we can do for now.
             self.progressSignal( 100*counter/numSlicings )
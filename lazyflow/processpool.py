@@ -0,0 +1,183 @@
+"""
+This module implements a pool of worker processes for CPU bound
+pure python computations of operators.
+
+The requests of lazyflow are executed by the Worker threads of a
+ThreadPool, python code inside of them is serialized by the GIL.
+Operators that spend most of their time in python loops can hand
+these loops to a separate process:
+
+---
+def _countAreas(img, numberOfChannels):
+    # module level function, must be picklable
+    ...
+
+class OpAreas(Operator):
+    executeInProcess = True
+
+    def execute(self, slot, subindex, roi, result):
+        img = self.inputs["Input"][:].allocate().wait()
+        return self.computeInProcess(_countAreas, (img, numC), result)
+---
+
+The result array of the computation is written into a shared memory
+buffer (a file in /dev/shm if available), so only the arguments
+need to be pickled. While the computation runs, a Worker thread
+executes other requests, only the waiting greenlet is suspended.
+"""
+
+import os
+import atexit
+import tempfile
+import threading
+import traceback
+import multiprocessing
+
+import numpy
+import greenlet
+
+from lazyflow.helpers import detectCPUs
+from lazyflow.request import Worker, CustomGreenlet, wakeUp
+
+
+def _sharedMemoryDirectory():
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm"
+    return None
+
+def _computeIntoFile(func, args, filename, shape, dtype):
+    """
+    runs in the child process, writes func(*args) into the
+    shared memory file. Returns None on success or the formatted
+    traceback of the exception that occurred.
+    """
+    try:
+        out = numpy.memmap(filename, dtype = dtype, mode = 'r+', shape = shape)
+        out[...] = func(*args)
+        out.flush()
+        del out
+    except:
+        return traceback.format_exc()
+    return None
+
+
+class ProcessPool(object):
+    """
+    A set of worker processes, that compute the results of
+    module level functions into shared memory buffers.
+
+    The processes are started on first use.
+    """
+
+    def __init__(self, numProcesses = None):
+        """
+        Arguments:
+          numProcesses : number of processes, defaults to the LAZYFLOW_PROCESS_COUNT
+                         environment variable or the number of cpus
+        """
+        if numProcesses is None:
+            if os.environ.has_key("LAZYFLOW_PROCESS_COUNT"):
+                numProcesses = int(os.environ["LAZYFLOW_PROCESS_COUNT"])
+            else:
+                numProcesses = detectCPUs()
+        self.numProcesses = numProcesses
+        self._pool = None
+        self._poolLock = threading.Lock()
+
+    def _getPool(self):
+        with self._poolLock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.numProcesses)
+            return self._pool
+
+    def compute(self, func, args, result):
+        """
+        Compute func(*args) in a worker process and write it into result.
+
+        Arguments:
+          func   : module level function, the returned value is assigned to result[...]
+          args   : tuple of picklable arguments for func
+          result : numpy.ndarray that receives the result
+
+        The calling Worker greenlet is suspended until the result is
+        available, other threads block. Returns result.
+        """
+        if result.size == 0:
+            result[...] = func(*args)
+            return result
+
+        fd, filename = tempfile.mkstemp(prefix = "lazyflow-", dir = _sharedMemoryDirectory())
+        try:
+            os.ftruncate(fd, result.nbytes)
+            buf = numpy.memmap(filename, dtype = result.dtype, mode = 'r+', shape = result.shape)
+        finally:
+            os.close(fd)
+
+        outcome = self._apply(_computeIntoFile, (func, args, filename, result.shape, result.dtype), filename)
+        if outcome is not None:
+            raise RuntimeError("Computation of %r in a worker process failed:\n%s" % (func, outcome))
+        result[...] = buf
+        del buf
+        return result
+
+    def _apply(self, func, args, filename):
+        """
+        helper function that applies func in a worker process and
+        waits for the outcome without blocking a Worker thread.
+        """
+        cur_gr = greenlet.getcurrent()
+        cur_tr = threading.current_thread()
+        cooperative = isinstance(cur_tr, Worker) and isinstance(cur_gr, CustomGreenlet)
+
+        lock = threading.Lock()
+        event = threading.Event()
+        state = {}
+
+        def finished(outcome):
+            # called by the result handler thread of the multiprocessing pool
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            with lock:
+                state["outcome"] = outcome
+                gr = state.get("greenlet")
+            if gr is not None:
+                gr.thread.finishedGreenlets.append(gr)
+                wakeUp(gr.thread)
+            event.set()
+
+        self._getPool().apply_async(func, args, callback = finished)
+
+        if cooperative:
+            with lock:
+                suspend = not state.has_key("outcome")
+                if suspend:
+                    state["greenlet"] = cur_gr
+            if suspend:
+                # switch back to the Worker run loop, finished() resumes us
+                cur_gr.parent.switch()
+        else:
+            event.wait()
+        return state["outcome"]
+
+    def close(self):
+        """
+        stop the worker processes.
+        """
+        with self._poolLock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+
+global_process_pool = ProcessPool()
+
+@atexit.register
+def stopProcessPool():
+    """
+    global atexit handler, on program exit stop
+    the worker processes.
+    """
+    global_process_pool.close()
@@ -7,8 +7,11 @@ from threading import Thread, current_thread
 import thread
 import greenlet
 import threading
+import weakref
 from helpers import detectCPUs
+from affinity import cpuGroups, pinCurrentThread, workerPlacement
 import math
+import heapq
 import logging
 import itertools
 
@@ -45,11 +48,26 @@ def runDebugShell():
 
 
 
+# returned by the greenlets of a Worker when they finished a request
+_REQUEST_FINISHED = object()
+
+def _executeRequests(request):
+    """
+    run function of the greenlets of a Worker. After a request is
+    executed the greenlet waits for the next one, so that it can
+    be reused instead of creating a new greenlet for every request.
+    """
+    while True:
+        request._execute()
+        request = greenlet.getcurrent().parent.switch(_REQUEST_FINISHED)
+
 class Worker(Thread):
     
     logger = logging.getLogger(__name__ + '.Worker')
+
+    maxIdleGreenlets = 16 # number of finished greenlets kept for reuse
     
-    def __init__(self, machine, wid = 0):
+    def __init__(self, machine, wid = 0, cpus = None, cpuGroup = None):
         Thread.__init__(self)
         self.daemon = True # kill automatically on application exit!
         self.logger.info( "Creating worker %r for ThreadPool %r" % (self, machine) )
@@ -61,12 +79,17 @@ class Worker(Thread):
         self.current_request = None
         #self.socket = zmq.Socket(context,zmq.SUB)
         #self.socket.bind("inproc://%d" % self.wid)
-        self.requests = deque()#PriorityQueue()
+        self.requests = deque() # local queue, popped LIFO by this worker and stolen FIFO by others
         self.finishedGreenlets = deque()
         self.process = psutil.Process(os.getpid())
         self.wlock = threading.Lock()
         self.wlock.acquire()
         self.workAvailable = False
+        self._liveGreenlets = 0 # started greenlets that did not finish yet
+        self._idleGreenlets = [] # greenlets that finished their request
+        self.switches = 0 # number of switches to greenlets, a progress counter for the Watchdog
+        self.cpus = cpus # the cpus the thread is pinned to, None if it is not pinned
+        self.cpuGroup = cpuGroup # index of the cpu group of the pool the cpus belong to
 
 
     def stop(self):
@@ -77,92 +100,93 @@ class Worker(Thread):
         wakeUp(self)
         self.join()
 
-    def flush(self):
-        allDone = False
+    def retire(self):
+        """
+        Let the worker exit without waiting for it. A retired worker does
+        not start new requests, but keeps running until its suspended
+        greenlets are finished.
+        """
+        self.logger.debug("retiring worker %r of machine %r" % (self, self.machine))
+        self.running = False
+        wakeUp(self)
 
-        while not allDone:
+    def flush(self):
         # wait untile all threads have nothing to do anymore
-            allDone = True
-            for w in self.machine.workers:
-                if w.running and (w.processing or len(self.machine.requests0) > 0):
-                    #print "Worker %r still working..." % w, len(self.machine.requests0)
-                    allDone = False
-                    time.sleep(0.03)
-                    break
+        self.machine.drain()
+
+    def _switch(self, gr, request = None):
+        self.switches += 1
+        if Request.EnableInstrumentation:
+            gr.request.switchCount += 1
+        lock = gr.switch(request)
+        if lock is _REQUEST_FINISHED:
+            self._liveGreenlets -= 1
+            gr.request = None
+            if len(self._idleGreenlets) < self.maxIdleGreenlets:
+                self._idleGreenlets.append(gr)
+        elif lock:
+          lock.release()
+
+    def _startRequest(self, req):
+        if len(self._idleGreenlets) > 0:
+            gr = self._idleGreenlets.pop()
+        else:
+            gr = CustomGreenlet(_executeRequests)
+            gr.thread = self
+        self.current_request = req
+        gr.request = req
+        self._liveGreenlets += 1
+        self._switch(gr, req)
 
 
     def run(self):
-            # cache value for less dict lookups
-        requests0 = self.machine.requests0
-        requests1 = self.machine.requests1
-        freeWorkers = self.machine.freeWorkers
-    
-        while self.running:
-            self.processing = False
-            freeWorkers.add(self)
-            #print "Worker %r sleeping..." % self
-            self.wlock.acquire()
+        if self.cpus is not None and not pinCurrentThread(self.cpus):
+            self.logger.debug("could not pin worker %r to cpus %r" % (self, self.cpus))
+        # cache value for less dict lookups
+        machine = self.machine
+        freeWorkers = machine.freeWorkers
+
+        while self.running or self._liveGreenlets > 0:
             self.processing = True
-            #print "Worker %r working..." % self
-            try:
-                freeWorkers.remove(self)
-            except KeyError:
-                pass
-            didRequest = True
-            while len(self.finishedGreenlets) != 0 or didRequest:
+            while True:
                 self.workAvailable = False
                 # first process all finished greenlets
                 while not len(self.finishedGreenlets) == 0:
                     gr = self.finishedGreenlets.popleft()
                     if gr.request.canceled is False:
                         self.current_request = gr.request
-                        lock = gr.switch()
-                        if lock:
-                          lock.release()
-    
-                # processan higher priority request if available
-                didRequest = False
-                req = None
-                try:
-                    req = requests1.pop()
-                    #prio, req = requests.get(block=False)
-                except IndexError:
-                    # requests was empty..
-                    pass
-                if req is not None and req.finished is False and req.canceled is False:
-                    didRequest = True
-                    gr = CustomGreenlet(req._execute)
-                    self.current_request = req
-                    gr.thread = self
-                    gr.request = req
-                    lock = gr.switch()
-                    if lock:
-                      lock.release()
-    
-                if didRequest is False:
-                    # only do a low priority request if no higher priority request
-                    # was available
-                    try:
-                        req = requests0.pop()
-                    except IndexError:
-                        # requests was empty..
-                        pass
-                    if req is not None and req.finished is False and req.canceled is False:
-                        didRequest = True
-                        gr = CustomGreenlet(req._execute)
-                        self.current_request = req
-                        gr.thread = self
-                        gr.request = req
-                        lock = gr.switch()
-                        if lock:
-                          lock.release()
-    
-                # reset the wait lock state, otherwise the surrounding while self.running loop will always be executed twice
-                try:
-                    self.wlock.release()
-                except thread.error:
-                    pass
+                        self._switch(gr)
+                    else:
+                        # canceled requests are never resumed
+                        self._liveGreenlets -= 1
+
+                if not self.running:
+                    # a retired worker hands its queued requests back to the pool
+                    machine._requeueLocalRequests(self)
+                    break
+
+                # then start the most urgent queued request
+                req = machine._popRequest(self)
+                if req is None:
+                    break
+                self._startRequest(req)
+
+            self.processing = False
+            if self.running:
+                freeWorkers.add(self)
+                # check again after registering as free worker: work that was
+                # queued in between would otherwise never wake us up.
+                idle = not machine._hasRequests()
+            else:
+                idle = self._liveGreenlets > 0
+            if idle and len(self.finishedGreenlets) == 0:
+                tracer = Request.tracer
+                if tracer is not None:
+                    idleStart = time.time()
                 self.wlock.acquire()
+                if tracer is not None:
+                    tracer._workerIdle(self, idleStart, time.time())
+            freeWorkers.discard(self)
 
 class Singleton(type):
     """
@@ -178,55 +202,453 @@ class Singleton(type):
         return cls.instance
 
 
+class Histogram(object):
+    """
+    Histogram with logarithmic bins: bin 0 counts the values
+    below base, bin i the values in [base*2**(i-1), base*2**i).
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        if value < self.base:
+            i = 0
+        else:
+            i = int(math.log(float(value) / self.base, 2)) + 1
+        if i >= len(self.counts):
+            self.counts.extend([0] * (i + 1 - len(self.counts)))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def copy(self):
+        hist = Histogram(self.base)
+        hist.counts = list(self.counts)
+        hist.count = self.count
+        hist.total = self.total
+        hist.max = self.max
+        return hist
+
+    def bins(self):
+        """
+        list of (upper bound, count) tuples
+        """
+        return [(self.base * 2**i, c) for i, c in enumerate(self.counts)]
+
+    def mean(self):
+        if self.count == 0:
+            return 0
+        return float(self.total) / self.count
+
+    def percentile(self, p):
+        """
+        upper bound of the bin that contains the p-th percentile (0 <= p <= 100)
+        """
+        if self.count == 0:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, c in self.bins():
+            seen += c
+            if seen >= rank and c > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def __repr__(self):
+        return "<Histogram count=%d mean=%g p50=%g p90=%g max=%g>" % (
+            self.count, self.mean(), self.percentile(50), self.percentile(90), self.max)
+
 class ThreadPool(object):
     """
-    This class uses the Singleton meta class to
-    represent the cpus of the machine
+    A set of Worker threads that execute the submitted requests.
+
+    The global_thread_pool instance represents the cpus of the
+    machine, graphs may own separate pools (see Graph). The number
+    of workers can be changed at runtime with resize().
+
+    Queued requests are kept in a heap that is ordered by the
+    request priority (Request.prio, deeper child requests have
+    a lower value and are executed first). To prevent starvation,
+    the sort key also includes the submission age: every
+    agingInterval submissions a waiting request gains one
+    priority level relative to newly submitted requests.
+
+    The submission age is counted separately for every client
+    (Request.client) and advances by 1/weight per submission (see
+    setClientWeight), in the manner of weighted fair queuing: the
+    count of a client that had no queued requests starts at the
+    count of the last started request. So a client that submits a
+    few requests is not queued behind the thousands of requests of
+    another one, and clients get shares of the workers that are
+    proportional to their weights.
+
+    Requests that are submitted from inside a worker of this pool
+    are not put into the shared heap but into the local queue of
+    that worker, so that they are executed on the thread that
+    already holds the data of their parent. Idle workers steal
+    the oldest requests from the local queues of other workers.
+
+    The pool counts the submitted requests that are not completed
+    yet, drain() and pause() wait on a condition variable until
+    this count drops to zero.
+
+    If Request.EnableInstrumentation is set, the pool collects
+    histograms of the queue latency, execution time and number of
+    greenlet switches of its finished requests, see statistics().
+
+    If the pool is created with an affinity mode, its workers are
+    pinned to the cpus of the machine (see lazyflow.affinity). A
+    request with a cpuGroup hint that is submitted from outside the
+    group is put into the local queue of a worker of that group, e.g.
+    the request of an operator whose input cache was allocated there.
     """
-    __metaclass__ = Singleton
 
-    def __init__(self):
+    agingInterval = 1000
+    compactionThreshold = 64 # minimum number of canceled requests before the heap is compacted
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self, numThreads = None, affinity = None):
+        """
+        Arguments:
+          numThreads : number of workers, defaults to the LAZYFLOW_THREAD_COUNT
+                       environment variable or the number of cpus
+          affinity   : None     - the workers are not pinned
+                       "cores"  - every worker is pinned to a single cpu
+                       "groups" - every worker is pinned to the cpus of a NUMA node
+                       defaults to the LAZYFLOW_THREAD_AFFINITY environment variable
+        """
         self._finished = False
-        #self.requests = PriorityQueue()
-        self.requests0 = deque()
-        self.requests1 = deque()
+        self._queue = [] # heap of (sortKey, submission count of the client, request)
+        self._canceledCount = 0 # requests canceled since the last compaction of the heap
+        self._queueLock = threading.Lock()
+        self._virtualTime = 0.0 # submission count of the last started request
+        self._clientCounts = {} # client -> submission count of its last request
+        self._clientStrides = {} # client -> 1 / weight
         self.workers = set()
         self.freeWorkers = set()
-        if os.environ.has_key("LAZYFLOW_THREAD_COUNT"):
-            self.numThreads = int(os.environ["LAZYFLOW_THREAD_COUNT"])
-        else:
-            self.numThreads = detectCPUs()
-        self.lastWorker = None
-        for i in range(self.numThreads):
-            w = Worker(self)
-            self.workers.add(w)
-            w.start()
-            self.lastWorker = w
+        self._workersLock = threading.Lock()
+        self._workerCounter = itertools.count()
+        if affinity is None:
+            affinity = os.environ.get("LAZYFLOW_THREAD_AFFINITY") or None
+        self.affinity = affinity
+        self._cpuGroups = cpuGroups() if affinity is not None else None
+        self._groupWorkers = None # cpu group -> tuple of its workers, if the workers are pinned
+        if numThreads is None:
+            if os.environ.has_key("LAZYFLOW_THREAD_COUNT"):
+                numThreads = int(os.environ["LAZYFLOW_THREAD_COUNT"])
+            else:
+                numThreads = detectCPUs()
         self._pausesLock = threading.Lock()
         self._pauses = 0
+        self._heldRequests = deque()
+        self._inflightCount = 0
+        self._completedCount = 0
+        self._inflightCondition = threading.Condition(threading.Lock())
+        self._statisticsLock = threading.Lock()
+        self.resetStatistics()
+        self.numThreads = 0
+        self.lastWorker = None
+        self.resize(numThreads)
+        ThreadPool._instances.add(self)
 
     def putRequest(self, request):
         """
-        Put a job in the queue of a free worker. if no
-        worker is free, put it to the threadpool request queue,
-        the first free worker will take it from there.
+        Put a job in the request queue and wake up a free
+        worker. if no worker is free, the first worker that
+        becomes free will take it from there.
+
+        While the pool is paused new top level requests are
+        held back until the pool is unpaused.
         """
-        #self.requests.put((request.prio,request))
-        if request.prio == 0:
-            if self._pauses == 0:
-              self.requests0.append(request)
-            else:
-              # silently drop request
-              # TODO: notify request of dropping ?
-              pass
+        if request.parent_request is None and self._pauses > 0:
+            self._pausesLock.acquire()
+            if self._pauses > 0:
+                self._heldRequests.append(request)
+                self._pausesLock.release()
+                return
+            self._pausesLock.release()
+        if Request.EnableInstrumentation:
+            request.submitTime = time.time()
+        self._inflightCondition.acquire()
+        request._inflight = self
+        self._inflightCount += 1
+        self._inflightCondition.release()
+        # not locked: a race only gives two requests the same count
+        client = request.client
+        count = self._clientCounts.get(client, 0.0)
+        if count < self._virtualTime:
+            count = self._virtualTime
+        count += self._clientStrides.get(client, 1.0)
+        self._clientCounts[client] = count
+        entry = (count + request.prio * self.agingInterval, count, request)
+        request._queueEntry = entry
+        cur_tr = threading.current_thread()
+        group = request.cpuGroup
+        if isinstance(cur_tr, Worker) and cur_tr.machine is self and cur_tr.running \
+                and (group is None or group == cur_tr.cpuGroup):
+            cur_tr.requests.append(entry)
+        elif group is not None and self._groupWorkers and self._putGroupRequest(group, entry):
+            return
         else:
-            self.requests1.append(request)
+            self._queueLock.acquire()
+            heapq.heappush(self._queue, entry)
+            self._queueLock.release()
         try:
             w = self.freeWorkers.pop()
             wakeUp(w)
         except KeyError:
             pass
 
+    def _putGroupRequest(self, group, entry):
+        """
+        Put the entry into the local queue of a worker of the cpu group,
+        preferably of a free one. Returns False if the group has no workers.
+        """
+        workers = self._groupWorkers.get(group)
+        if not workers:
+            return False
+        free = [w for w in workers if w in self.freeWorkers]
+        if len(free) > 0:
+            w = free[0]
+        else:
+            w = workers[int(entry[1]) % len(workers)]
+        w.requests.append(entry)
+        if not w.running:
+            # the worker retired in between
+            self._requeueLocalRequests(w)
+        try:
+            self.freeWorkers.remove(w)
+            wakeUp(w)
+        except KeyError:
+            # the worker is busy, let an idle worker of another group steal
+            # the request instead of leaving the cpus unused
+            try:
+                wakeUp(self.freeWorkers.pop())
+            except KeyError:
+                pass
+        return True
+
+    def setClientWeight(self, client, weight):
+        """
+        Set the share of the workers that the requests with the client
+        tag get relative to the other clients, the default weight is 1.
+        """
+        assert weight > 0, "the weight of a client must be positive"
+        self._clientStrides[client] = 1.0 / weight
+
+    def _popRequest(self, worker):
+        """
+        Remove and return the most urgent request that still needs to be
+        executed by the given worker, or None if there is none.
+
+        The worker's local queue is used in LIFO order unless the shared
+        heap holds a more urgent request. If both are empty, the oldest
+        request of another worker's local queue is stolen.
+        """
+        local = worker.requests
+        while True:
+            entry = None
+            try:
+                localKey = local[-1][0]
+            except IndexError:
+                localKey = None
+            if len(self._queue) > 0:
+                self._queueLock.acquire()
+                if len(self._queue) > 0 and (localKey is None or self._queue[0][0] < localKey):
+                    entry = heapq.heappop(self._queue)
+                self._queueLock.release()
+            if entry is None and localKey is not None:
+                try:
+                    entry = local.pop()
+                except IndexError:
+                    # a thief was faster
+                    pass
+            if entry is None:
+                entry = self._stealRequest(worker)
+                if entry is None:
+                    return None
+            req = entry[2]
+            if entry is not req._queueEntry:
+                # the request was queued again with another priority
+                continue
+            if req.finished is False and req.canceled is False:
+                if req.started is False:
+                    req._queueEntry = None
+                    if entry[1] > self._virtualTime:
+                        self._virtualTime = entry[1]
+                    return req
+                # a waiting greenlet is executing the request, it
+                # calls _requestDone when it is finished
+                continue
+            self._requestDone(req)
+
+    def _requestDone(self, request):
+        """
+        Called when a submitted request has finished or was discarded,
+        wakes up the threads waiting in drain() when it was the last one.
+        """
+        self._inflightCondition.acquire()
+        if request._inflight is self:
+            request._inflight = None
+            self._inflightCount -= 1
+            self._completedCount += 1
+            if self._inflightCount == 0:
+                self._inflightCondition.notifyAll()
+        self._inflightCondition.release()
+
+    def _requeueRequest(self, request):
+        """
+        Put a queued request into the shared heap again with the sort key
+        of its current priority, it keeps its submission number. The old
+        entry becomes stale and is skipped when it is popped.
+        """
+        self._queueLock.acquire()
+        entry = request._queueEntry
+        if entry is not None and request.started is False:
+            count = entry[1]
+            entry = (count + request.prio * self.agingInterval, count, request)
+            request._queueEntry = entry
+            heapq.heappush(self._queue, entry)
+        self._queueLock.release()
+        try:
+            wakeUp(self.freeWorkers.pop())
+        except KeyError:
+            pass
+
+    def _requestCanceled(self, request):
+        """
+        Called when a submitted request was canceled. Canceled requests
+        are discarded lazily when they are popped from the queue, the
+        shared heap is compacted when canceled requests make up
+        more than half of it.
+        """
+        self._requestDone(request)
+        if request.started:
+            return
+        self._queueLock.acquire()
+        self._canceledCount += 1
+        if self._canceledCount > self.compactionThreshold and self._canceledCount * 2 > len(self._queue):
+            self._queue[:] = [entry for entry in self._queue
+                              if entry[2].canceled is False and entry is entry[2]._queueEntry]
+            heapq.heapify(self._queue)
+            self._canceledCount = 0
+        self._queueLock.release()
+
+    def _recordStatistics(self, request):
+        """
+        Called by instrumented requests when they are finished.
+        """
+        self._statisticsLock.acquire()
+        if request.submitTime is not None:
+            self._statistics["queueLatency"].add(request.startTime - request.submitTime)
+        self._statistics["executionTime"].add(request.finishTime - request.startTime)
+        self._statistics["switches"].add(request.switchCount)
+        self._statisticsLock.release()
+
+    def statistics(self):
+        """
+        Return the histograms collected from the finished requests
+        while Request.EnableInstrumentation was set:
+
+          queueLatency  : seconds between submission and start of a request,
+                          requests that were executed directly by a waiting
+                          thread are not counted
+          executionTime : seconds between start and end of a request,
+                          including the time it waited for other requests
+          switches      : number of times a worker switched to the greenlet
+                          of a request
+        """
+        self._statisticsLock.acquire()
+        statistics = dict((name, hist.copy()) for name, hist in self._statistics.items())
+        self._statisticsLock.release()
+        return statistics
+
+    def resetStatistics(self):
+        self._statisticsLock.acquire()
+        self._statistics = { "queueLatency" : Histogram(1e-6),
+                             "executionTime" : Histogram(1e-6),
+                             "switches" : Histogram(1) }
+        self._statisticsLock.release()
+
+    def _stealRequest(self, thief):
+        for w in list(self.workers):
+            if w is not thief:
+                try:
+                    return w.requests.popleft()
+                except IndexError:
+                    pass
+        return None
+
+    def _requeueLocalRequests(self, worker):
+        """
+        Move the local requests of a retired worker to the shared heap.
+        """
+        entries = []
+        while True:
+            try:
+                entries.append(worker.requests.popleft())
+            except IndexError:
+                break
+        if len(entries) > 0:
+            self._queueLock.acquire()
+            for entry in entries:
+                heapq.heappush(self._queue, entry)
+            self._queueLock.release()
+            for i in range(len(entries)):
+                try:
+                    wakeUp(self.freeWorkers.pop())
+                except KeyError:
+                    break
+
+    def _hasRequests(self):
+        if len(self._queue) > 0:
+            return True
+        for w in list(self.workers):
+            if len(w.requests) > 0:
+                return True
+        return False
+
+    def resize(self, numThreads):
+        """
+        Change the number of workers. New workers are started
+        immediately, retired workers exit as soon as their
+        running requests are finished.
+        """
+        assert numThreads > 0, "a ThreadPool needs at least one worker"
+        self._workersLock.acquire()
+        try:
+            while len(self.workers) < numThreads:
+                wid = self._workerCounter.next()
+                if self.affinity is not None:
+                    cpus, group = workerPlacement(wid, self.affinity, self._cpuGroups)
+                    w = Worker(self, wid = wid, cpus = cpus, cpuGroup = group)
+                else:
+                    w = Worker(self, wid = wid)
+                self.workers.add(w)
+                w.start()
+                self.lastWorker = w
+            while len(self.workers) > numThreads:
+                w = self.workers.pop()
+                if w is self.lastWorker:
+                    self.lastWorker = iter(self.workers).next()
+                self.freeWorkers.discard(w)
+                w.retire()
+            self.numThreads = numThreads
+            if self.affinity is not None:
+                groupWorkers = {}
+                for w in sorted(self.workers, key = lambda w: w.wid):
+                    groupWorkers.setdefault(w.cpuGroup, []).append(w)
+                self._groupWorkers = dict((g, tuple(ws)) for g, ws in groupWorkers.items())
+        finally:
+            self._workersLock.release()
+
     def stopThreadPool(self):
         """
         wait until all requests are processed and stop the workers.
@@ -234,33 +656,66 @@ class ThreadPool(object):
         if not self._finished:
             self._finished = True
             # stop the workers of the machine
-            for w in self.workers:
+            for w in list(self.workers):
                 w.stop()
 
+    def drain(self, timeout = None):
+        """
+        Wait until all submitted requests are completed.
+
+        Arguments:
+          timeout : maximum time to wait in seconds, None waits indefinitely
+
+        Returns True if the pool is drained, False if the timeout expired.
+        """
+        cur_tr = threading.current_thread()
+        patchIfForeignThread(cur_tr)
+        assert cur_tr.current_request == None, "ERROR: the threadpool cannot be drained from inside a request"
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._inflightCondition.acquire()
+        try:
+            while self._inflightCount > 0:
+                if timeout is None:
+                    self._inflightCondition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._inflightCondition.wait(remaining)
+            return True
+        finally:
+            self._inflightCondition.release()
+
     def pause(self):
         """
-        Pause Threadpool : drop new requests, wait unitl existing requests
+        Pause Threadpool : hold back new requests, wait unitl existing requests
         are executed, increase _pauses counter
         """
         cur_tr = threading.current_thread()
-        print cur_tr.current_request
+        patchIfForeignThread(cur_tr)
         assert cur_tr.current_request == None, "ERROR: the threadpool cannot be paused from inside a request"
         self._pausesLock.acquire()
         self._pauses += 1
         self._pausesLock.release()
-        for w in self.workers:
-          w.flush()
+        self.drain()
 
 
     def unpause(self):
         """
         Unpause Threadpool : decreases the pauses counter, when
-        reaching 0 requests are processed again
+        reaching 0 the held back requests are submitted again
         """
         self._pausesLock.acquire()
         if self._pauses > 0:
           self._pauses -= 1
+        held = []
+        if self._pauses == 0:
+            held = self._heldRequests
+            self._heldRequests = deque()
         self._pausesLock.release()
+        for request in held:
+            self.putRequest(request)
 
 @atexit.register
 def stopThreadPool():
@@ -268,12 +723,8 @@ def stopThreadPool():
     global atexit handler, on program exit stop
     all workers.
     """
-    # get the machine singleton
-    machine = ThreadPool()
-    machine.stopThreadPool()
-
-# create a  globalmachine instance
-global_thread_pool = ThreadPool()
+    for machine in list(ThreadPool._instances):
+        machine.stopThreadPool()
 
 
 # unused decorator
@@ -312,6 +763,7 @@ class Lock(object):
         self.lock1.acquire()
         self.lock2 = threading.Lock()
         self.waiting = deque()
+        self.owner = None # greenlet that holds the lock, reported by the Watchdog
 
     def acquire(self):
         try:
@@ -319,6 +771,7 @@ class Lock(object):
             # this Lock object is already acquired by somebody else
             self.lock1.release()
             self.lock2.acquire()
+            self.owner = greenlet.getcurrent()
         except thread.error:
             # equivalent to locked
             cur_gr = greenlet.getcurrent()
@@ -329,6 +782,7 @@ class Lock(object):
 
 
     def release(self):
+        self.owner = None
         self.lock2.release()
 
         # try to pop a waiting greenlet from the queue
@@ -340,12 +794,156 @@ class Lock(object):
             # because the greenlet that is woken up
             # will release it for us
             self.lock2.acquire()
+            self.owner = gr
             gr.thread.finishedGreenlets.appendleft(gr)
             wakeUp(gr.thread)
         except IndexError:
             # indicate that this Lock object can be acquired again
             self.lock1.acquire()
 
+class RequestTimeoutError(RuntimeError):
+    """
+    Raised by Request.wait and Pool.wait when the timeout expired.
+    """
+    pass
+
+class _CompletionQueue(object):
+    """
+    Collects the finished requests of Pool.imap and Pool.as_completed.
+
+    get() blocks until a request finished, inside of a Worker only
+    the calling greenlet is suspended.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.finished = deque()
+        self.waiter = None # waiting greenlet or threading.Event
+
+    def put(self, request, entry):
+        """
+        onFinish callback of the collected requests.
+        """
+        self.lock.acquire()
+        self.finished.append(entry)
+        waiter = self.waiter
+        self.waiter = None
+        self.lock.release()
+        if isinstance(waiter, greenlet.greenlet):
+            waiter.thread.finishedGreenlets.append(waiter)
+            wakeUp(waiter.thread)
+        elif waiter is not None:
+            waiter.set()
+
+    def get(self):
+        self.lock.acquire()
+        if len(self.finished) == 0:
+            cur_tr = threading.current_thread()
+            if isinstance(cur_tr, Worker):
+                self.waiter = greenlet.getcurrent()
+                # switch back to parent, parent will release lock
+                self.waiter.parent.switch(self.lock)
+            else:
+                event = self.waiter = threading.Event()
+                self.lock.release()
+                event.wait()
+            self.lock.acquire()
+        entry = self.finished.popleft()
+        self.lock.release()
+        return entry
+
+class MemoryBudget(object):
+    """
+    Limits the number of bytes that the destinations of in-flight
+    requests may occupy together.
+
+    Requests reserve the bytes of their destination before they
+    are executed and release them when they are finished. If the
+    reservation would exceed the limit, reserve() blocks until
+    enough bytes are released, inside of a Worker only the calling
+    greenlet is suspended. A reservation is always granted if no
+    bytes are outstanding, so a request that is larger than the
+    limit runs alone instead of blocking forever.
+
+    Only top level requests should wait for the budget: the bytes
+    of child requests are counted, but a child is never held back,
+    since its parent already holds its reservation and waits for it.
+
+    The global_memory_budget instance is disabled unless the
+    LAZYFLOW_MEMORY_BUDGET environment variable is set (in MB) or
+    setLimit() is called.
+    """
+
+    def __init__(self, limit = None):
+        """
+        Arguments:
+          limit : maximum number of outstanding bytes, None disables the budget
+        """
+        self.limit = limit
+        self.outstanding = 0
+        self.lock = threading.Lock()
+        self.waiting = deque() # (nbytes, waiting greenlet or threading.Event)
+
+    def setLimit(self, limit):
+        """
+        change the limit, None disables the budget and admits
+        all waiting reservations.
+        """
+        self.lock.acquire()
+        self.limit = limit
+        self._admitWaiting()
+
+    def reserve(self, nbytes, block = True):
+        """
+        reserve nbytes, if block is True wait until they fit
+        into the budget.
+        """
+        self.lock.acquire()
+        if not block or self._fits(nbytes):
+            self.outstanding += nbytes
+            self.lock.release()
+            return
+        cur_tr = threading.current_thread()
+        if isinstance(cur_tr, Worker):
+            cur_gr = greenlet.getcurrent()
+            self.waiting.append((nbytes, cur_gr))
+            # switch back to parent, parent will release lock,
+            # the bytes are reserved when we are woken up
+            cur_gr.parent.switch(self.lock)
+        else:
+            event = threading.Event()
+            self.waiting.append((nbytes, event))
+            self.lock.release()
+            event.wait()
+
+    def release(self, nbytes):
+        """
+        release nbytes and admit the waiting reservations
+        that fit into the budget now.
+        """
+        self.lock.acquire()
+        self.outstanding -= nbytes
+        self._admitWaiting()
+
+    def _fits(self, nbytes):
+        return (self.limit is None or self.outstanding == 0 or
+                self.outstanding + nbytes <= self.limit)
+
+    def _admitWaiting(self):
+        # must be called with self.lock held, releases it
+        admitted = []
+        while len(self.waiting) > 0 and self._fits(self.waiting[0][0]):
+            nbytes, waiter = self.waiting.popleft()
+            self.outstanding += nbytes
+            admitted.append(waiter)
+        self.lock.release()
+        for waiter in admitted:
+            if isinstance(waiter, greenlet.greenlet):
+                waiter.thread.finishedGreenlets.append(waiter)
+                wakeUp(waiter.thread)
+            else:
+                waiter.set()
+
 class Pool(object):
     """
     Request pool class for handling many requests jointly
@@ -400,12 +998,24 @@ class Pool(object):
             for r in self.requests:
                 r.submit()
                 r.onFinish(self._req_finished)
+                # a canceled request is never finished
+                r.onCancel(self._req_finished)
 
-    def wait(self):
+    def wait(self, timeout = None):
         """
         Start processing of the requests and blocking wait for their completion.
+
+        Arguments:
+          timeout : maximum time in seconds to wait for all requests, None waits indefinitely
+
+        Raises a RequestTimeoutError if not all requests are finished in time.
         """
-        if self.must_finish == 1:
+        if timeout is not None:
+            self.submit()
+            deadline = time.time() + timeout
+            for r in self.requests:
+                r.wait(max(0, deadline - time.time()))
+        elif self.must_finish == 1:
             self.requests[0].wait()
             self._finalize()
         else:
@@ -464,6 +1074,95 @@ class Pool(object):
     def _release_lock(self, lock):
         lock.release()
 
+    @staticmethod
+    def as_completed(requests):
+        """
+        Submit the given requests and yield each of them as soon
+        as it is finished. Cancelled requests are never yielded.
+        """
+        queue = _CompletionQueue()
+        requests = list(requests)
+        for r in requests:
+            r.submit()
+            r.onFinish(queue.put, entry = r)
+            # a canceled request is never finished, count it as done
+            r.onCancel(queue.put, entry = None)
+        for i in range(len(requests)):
+            entry = queue.get()
+            if entry is not None:
+                yield entry
+
+    @staticmethod
+    def imap(func, items, max_in_flight = 10, max_bytes = None, nbytes = None, ordered = True):
+        """
+        Stream over a large number of requests with bounded memory.
+
+        Arguments:
+          func          : function that returns a request (e.g. a slot request) for an item
+          items         : iterable of items, consumed lazily
+          max_in_flight : maximum number of submitted requests whose results
+                          were not yielded yet
+          max_bytes     : optional bound of the summed nbytes(item) of these requests,
+                          a single request is always allowed
+          nbytes        : function that estimates the memory of the result for an item,
+                          required if max_bytes is given
+          ordered       : if True, the results are yielded in the order of the items,
+                          otherwise as soon as they are finished
+
+        Yields (item, result) tuples, the items of canceled requests
+        are skipped, e.g.
+
+          for key, data in Pool.imap(lambda key: slot[key], keys, max_in_flight = 4):
+              f[key] = data
+        """
+        assert max_in_flight > 0
+        assert max_bytes is None or nbytes is not None, "max_bytes requires the nbytes estimate"
+        items = iter(items)
+        queue = _CompletionQueue()
+        active = deque() # [item, request, size] in submission order
+        inflightBytes = 0
+        pending = None
+        exhausted = False
+        while True:
+            # fill the window
+            while not exhausted and len(active) < max_in_flight:
+                if pending is None:
+                    try:
+                        item = items.next()
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    size = nbytes(item) if nbytes is not None else 0
+                    pending = (item, size)
+                item, size = pending
+                if max_bytes is not None and len(active) > 0 and inflightBytes + size > max_bytes:
+                    break
+                pending = None
+                req = func(item)
+                entry = [item, req, size]
+                active.append(entry)
+                inflightBytes += size
+                req.submit()
+                if not ordered:
+                    req.onFinish(queue.put, entry = entry)
+                    # a canceled request is never finished
+                    req.onCancel(queue.put, entry = entry)
+
+            if len(active) == 0:
+                return
+
+            if ordered:
+                entry = active.popleft()
+                result = entry[1].wait()
+            else:
+                entry = queue.get()
+                active.remove(entry)
+                result = entry[1].result
+            inflightBytes -= entry[2]
+            if entry[1].canceled:
+                continue
+            yield entry[0], result
+
 
 class Request(object):
     """
@@ -478,22 +1177,54 @@ class Request(object):
     logger = logging.getLogger(__name__ + '.Request')
     EnableRequesterStackDebugging = False
 
+    # If set, requests record their timing information (see
+    # the submitTime, ... attributes) and ThreadPools collect
+    # statistics about them.
+    EnableInstrumentation = False
+
+    # object that is notified of finished requests, waits and idle workers
+    # (see lazyflow.chrometrace.ChromeTrace)
+    tracer = None
+
+    # requests are created for every slot access, keep them small
+    __slots__ = ("running", "started", "finished", "canceled", "processing", "lock",
+                 "function", "kwargs", "callbacks_cancel", "callbacks_finish", "callbacks_failure",
+                 "waiting_greenlets", "child_requests", "result", "parent_request",
+                 "prio", "client", "cpuGroup", "cheap", "threadPool", "_inflight", "_queueEntry", "_requesterStack",
+                 "submitTime", "startTime", "finishTime", "workerId", "switchCount",
+                 "__weakref__")
+
     def __init__(self, function, **kwargs):
-        self.running = False
+        self.running = False # submitted or executed
+        self.started = False # the execution of the function started
         self.finished = False
         self.canceled = False
         self.processing = False
         self.lock = threading.Lock()
         self.function = function
         self.kwargs = kwargs
-        self.callbacks_cancel = []
-        self.callbacks_finish = []
-        self.waiting_greenlets = []
+        # the callback lists, waiting greenlets and child requests
+        # are created when the first element is added
+        self.callbacks_cancel = ()
+        self.callbacks_finish = ()
+        self.callbacks_failure = ()
+        self.waiting_greenlets = ()
         #self.waiting_locks = []
-        self.child_requests = set()
+        self.child_requests = ()
         self.result = None
         self.parent_request = None
         self.prio = 0
+        self.client = None # tag for the fair scheduling of the requests of different clients, see ThreadPool
+        self.cpuGroup = None # cpu group whose workers should execute the request, see ThreadPool
+        self.cheap = False # the function only relays or copies data, see Operator.cheapExecute
+        self.threadPool = global_thread_pool # the pool that executes the request when it is submitted
+        self._inflight = None # the pool the request was submitted to, until it is completed
+        self._queueEntry = None # the valid entry of the request in the queue of its pool
+        self.submitTime = None # time the request was put into a ThreadPool
+        self.startTime = None  # time the execution started
+        self.finishTime = None # time the function returned
+        self.workerId = None   # wid of the Worker that started the execution, None for other threads
+        self.switchCount = 0   # number of times a Worker switched to the greenlet of the request
         cur_gr = greenlet.getcurrent()
         cur_tr = threading.current_thread()
         patchIfForeignThread(cur_tr)
@@ -502,9 +1233,14 @@ class Request(object):
             self.parent_request = cur_tr.current_request
             if self.parent_request is not None:
               self.prio = self.parent_request.prio - 1
+              self.client = self.parent_request.client
+              self.threadPool = self.parent_request.threadPool
 
               # self.parent_request.lock.acquire()
-              self.parent_request.child_requests.add(self)
+              if self.parent_request.child_requests:
+                  self.parent_request.child_requests.add(self)
+              else:
+                  self.parent_request.child_requests = set((self,))
               # self.parent_request.lock.release()
 
               # always hold back one request that
@@ -536,9 +1272,17 @@ class Request(object):
         except thread.error:
             pass
 
-    def wait(self, timeout = 0):
+    def wait(self, timeout = None):
         """
         synchronous wait for exectution of function
+
+        Arguments:
+          timeout : maximum time in seconds to wait for the result, None waits
+                    indefinitely. If a timeout is given, a request that is not
+                    running yet is submitted to its ThreadPool instead of being
+                    executed by the calling thread.
+
+        Raises a RequestTimeoutError if the request is not finished in time.
         """
         cur_gr = greenlet.getcurrent()
         cur_tr = threading.current_thread()
@@ -556,22 +1300,47 @@ class Request(object):
             last_request.submit()
         cur_tr.last_request = None
 
+        if timeout is not None or (isinstance(cur_tr, Worker) and cur_tr.machine is not self.threadPool):
+            # a Worker does not execute requests of other pools, e.g.
+            # blocking reads are left to the workers of the I/O pool
+            self.submit()
+
         self.lock.acquire()
         if not self.finished and not self.canceled:
-            if not self.running:
+            if not self.running or (self.cheap and not self.started and timeout is None and
+                                    isinstance(cur_tr, Worker) and cur_tr.machine is self.threadPool and
+                                    self.parent_request is cur_tr.current_request):
+                # the request was not submitted, or it is a cheap child request
+                # that is still queued in our pool: execute it on the stack of
+                # the waiting greenlet instead of suspending it until a Worker
+                # executed the request
                 self.running = True
+                self.started = True
                 self.lock.release()
-                self._execute()
+                self._run()
             else:
+                tracer = self.tracer
+                if tracer is not None:
+                    waiter = cur_tr.current_request
+                    waitStart = time.time()
                 # wait for results
                 if isinstance(cur_tr, Worker):
             # just wait for the request to finish
             # we will get woken up
-                    self.waiting_greenlets.append(cur_gr)
-                    
+                    if self.waiting_greenlets:
+                        self.waiting_greenlets.append(cur_gr)
+                    else:
+                        self.waiting_greenlets = [cur_gr]
+                    timer = None
+                    if timeout is not None:
+                        timer = threading.Timer(timeout, self._resumeTimedOut, args = (cur_gr,))
+                        timer.start()
+
                     # switch back to parent, parent will release lock 
                     cur_gr.parent.switch(self.lock)
-                else:
+                    if timer is not None:
+                        timer.cancel()
+                elif timeout is None:
                     lock = cur_tr.wlock
                     try:
                         lock.release()
@@ -579,13 +1348,61 @@ class Request(object):
                         pass
                     lock.acquire()
                     #self.waiting_locks.append(lock)
-                    self.callbacks_finish.append((Request._releaseLock, {"lock" : lock}))
+                    self._appendFinishCallback((Request._releaseLock, {"lock" : lock}))
                     self.lock.release()
                     lock.acquire()
+                else:
+                    event = threading.Event()
+                    callback = (Request._setEvent, {"event" : event})
+                    self._appendFinishCallback(callback)
+                    self.lock.release()
+                    if not event.wait(timeout):
+                        self._removeFinishCallback(callback)
+                if tracer is not None:
+                    tracer._requestWaited(cur_tr, waiter, self, waitStart, time.time())
+                if not self.finished and not self.canceled:
+                    raise RequestTimeoutError("Request %r did not finish within %r seconds" % (self, timeout))
         else:
           self.lock.release()
         return self.result
 
+    def _setEvent(self, event):
+        """
+        helper function that is used by the wait method
+        to wake up a non-worker thread that waits with a timeout.
+        """
+        event.set()
+
+    def _appendFinishCallback(self, callback):
+        # must be called with self.lock held and the request not finished
+        if self.callbacks_finish:
+            self.callbacks_finish.append(callback)
+        else:
+            self.callbacks_finish = [callback]
+
+    def _removeFinishCallback(self, callback):
+        self.lock.acquire()
+        if self.callbacks_finish:
+            try:
+                self.callbacks_finish.remove(callback)
+            except ValueError:
+                pass
+        self.lock.release()
+
+    def _resumeTimedOut(self, gr):
+        """
+        helper function that resumes a greenlet that waits
+        for this request when its timeout expired.
+        """
+        self.lock.acquire()
+        if self.waiting_greenlets and gr in self.waiting_greenlets:
+            self.waiting_greenlets.remove(gr)
+            self.lock.release()
+            gr.thread.finishedGreenlets.append(gr)
+            wakeUp(gr.thread)
+        else:
+            self.lock.release()
+
     def submit(self):
         """
         asynchronous execution in background
@@ -602,19 +1419,50 @@ class Request(object):
         if not self.running:
             self.running = True
             self.lock.release()
-            global_thread_pool.putRequest(self)
+            self.threadPool.putRequest(self)
         else:
             self.lock.release()
         return self
 
 
+    def setPriority(self, prio):
+        """
+        Change the priority of the request and of its child requests
+        that are not started yet, requests with a lower value are
+        executed first. Child requests keep their distance to the
+        priority of their parent.
+
+        Queued requests are moved in the queue of their ThreadPool,
+        e.g. an interactive client can boost the requests of the
+        visible tiles and demote the others without canceling them.
+        """
+        self.lock.acquire()
+        delta = prio - self.prio
+        self.prio = prio
+        requeue = self._queueEntry is not None and not self.started
+        child_requests = list(self.child_requests)
+        self.lock.release()
+        if delta == 0:
+            return self
+        if requeue:
+            inflight = self._inflight
+            if inflight is not None:
+                inflight._requeueRequest(self)
+        for child in child_requests:
+            if child.started is False:
+                child.setPriority(child.prio + delta)
+        return self
+
     def onCancel(self, callback, *args, **kwargs):
         """
         specify a callback that is called when the request is canceled.
         """
         self.lock.acquire()
         if not self.canceled:
-            self.callbacks_cancel.append((callback, args, kwargs))
+            if self.callbacks_cancel:
+                self.callbacks_cancel.append((callback, args, kwargs))
+            else:
+                self.callbacks_cancel = [(callback, args, kwargs)]
             self.lock.release()
         else:
             self.lock.release()
@@ -629,7 +1477,7 @@ class Request(object):
         """
         self.lock.acquire()
         if not self.finished:
-            self.callbacks_finish.append((callback, kwargs))
+            self._appendFinishCallback((callback, kwargs))
             self.lock.release()
         else:
             self.lock.release()
@@ -637,36 +1485,140 @@ class Request(object):
         return self
 
 
+    def describe(self, details = False):
+        """
+        Return a short label of the request for diagnostics, e.g.
+        "OpArrayCache.Output" for the request of a slot. If details
+        is True, the roi and the id of the request are added.
+        """
+        function = self.function
+        if hasattr(function, "operator") and hasattr(function, "slot"):
+            # Slot.RequestExecutionWrapper
+            label = "%s.%s" % (function.operator.name, function.slot.name)
+            roi = self.kwargs.get("roi") if self.kwargs else None
+            if details and roi is not None:
+                label += " %s" % (roi,)
+        else:
+            label = getattr(function, "__name__", type(function).__name__)
+        if details:
+            label = "%s <Request 0x%x>" % (label, id(self))
+        return label
+
     def cancel(self):
         """
         cancel a running request
+
+        The request is canceled unless one of its onCancel callbacks
+        returns False. A canceled request drops its arguments (e.g.
+        the destination array) and its finish callbacks, is discarded
+        from the queue of its ThreadPool, and the threads waiting for
+        it are woken up: their wait returns None.
         """
         self.lock.acquire()
-        if not self.finished:
+        if not self.finished and not self.canceled:
             callbacks_cancel = self.callbacks_cancel
-            self.callbacks_cancel = []
+            self.callbacks_cancel = ()
             child_requests = self.child_requests
-            self.child_requests = set()
+            self.child_requests = ()
             self.lock.release()
 
-            canceled = True
-            for c in callbacks_cancel:
+            for i, c in enumerate(callbacks_cancel):
             # call the callback tuples
-                canceled = c[0](self, *c[1],**c[2])
-                if canceled is False:
+                if c[0](self, *c[1],**c[2]) is False:
                     self.logger.debug( "onCancel callback refused cancellation" )
-                    break
-            if canceled:
-                self.logger.debug( "cancelling request" )
-                for c in child_requests:
-                    print "canceling child.."
-                    c.cancel()
-                self.canceled = True
+                    # keep the callbacks that did not accept yet
+                    # and the children for a later cancel
+                    self.lock.acquire()
+                    self.callbacks_cancel = list(callbacks_cancel[i:]) + list(self.callbacks_cancel)
+                    if self.child_requests:
+                        self.child_requests.update(child_requests)
+                    else:
+                        self.child_requests = child_requests
+                    self.lock.release()
+                    return
+            self.logger.debug( "cancelling request" )
+
+            # mark the request as canceled before its children are canceled:
+            # canceling a child wakes the greenlet of this request if it
+            # waits for the child, and the Workers must not resume it then.
+            self.lock.acquire()
+            if self.finished:
+                self.lock.release()
+                return
+            self.canceled = True
+            self.kwargs = {}
+            waiting_greenlets = self.waiting_greenlets
+            self.waiting_greenlets = ()
+            callbacks_finish = self.callbacks_finish
+            self.callbacks_finish = ()
+            self.lock.release()
+
+            for c in child_requests:
+                c.cancel()
+
+            for gr in waiting_greenlets:
+                gr.thread.finishedGreenlets.append(gr)
+                wakeUp(gr.thread)
+            for c in callbacks_finish:
+                # wake up the waiting non-worker threads
+                if c[0] == Request._releaseLock or c[0] == Request._setEvent:
+                    c[0](self, **c[1])
+
+            # a canceled request is never resumed
+            inflight = self._inflight
+            if inflight is not None:
+                inflight._requestCanceled(self)
         else:
             self.lock.release()
             self.logger.debug( "tried to cancel but: self.finished={}, self.canceled={}".format(self.finished, self.canceled) )
 
+    def onFailure(self, callback, **kwargs):
+        """
+        specify a callback that is called with the request and the
+        exception if the function of the request raises. The finish
+        callbacks of a failed request are never called.
+        """
+        self.lock.acquire()
+        if self.callbacks_failure:
+            self.callbacks_failure.append((callback, kwargs))
+        else:
+            self.callbacks_failure = [(callback, kwargs)]
+        self.lock.release()
+        return self
+
+    def _failed(self, exception, cur_tr, req_backup):
+        """
+        helper function that is called when the function of the request
+        raised: calls the callbacks specified with onFailure and releases
+        the request from its ThreadPool. The caller passes the exception on.
+        """
+        cur_tr.current_request = req_backup
+        self.lock.acquire()
+        callbacks_failure = self.callbacks_failure
+        self.callbacks_failure = ()
+        self.lock.release()
+        try:
+            for c in callbacks_failure:
+                c[0](self, exception, **c[1])
+        finally:
+            inflight = self._inflight
+            if inflight is not None:
+                inflight._requestDone(self)
+
     def _execute(self):
+        """
+        helper function that is called by the Workers to execute a
+        queued request, unless a waiting greenlet already started it.
+        """
+        self.lock.acquire()
+        if self.started:
+            self.lock.release()
+            return
+        self.started = True
+        self.lock.release()
+        self._run()
+
+    def _run(self):
         """
         helper function that executes the actual function of the request
         calls all callbacks specified with onNotify and
@@ -674,6 +1626,7 @@ class Request(object):
         """
             # assert self.running is True
             # assert self.finished is False
+        kwargs = self.kwargs # cancel() drops the arguments
         if self.canceled:
             return
 
@@ -681,8 +1634,23 @@ class Request(object):
         req_backup = cur_tr.current_request
         cur_tr.current_request = self
 
+        instrumented = self.EnableInstrumentation
+        if instrumented:
+            self.startTime = time.time()
+            self.workerId = getattr(cur_tr, "wid", None)
+
         # do the actual work
-        self.result = self.function(**self.kwargs)
+        try:
+            self.result = self.function(**kwargs)
+        except Exception as e:
+            self._failed(e, cur_tr, req_backup)
+            raise
+
+        if instrumented:
+            self.finishTime = time.time()
+            self.threadPool._recordStatistics(self)
+            if self.tracer is not None:
+                self.tracer._requestFinished(self)
 
         self.lock.acquire()
         self.processing = True
@@ -698,10 +1666,9 @@ class Request(object):
         #self.lock.acquire()
         if self.parent_request is not None:
             # self.parent_request.lock.acquire()
-            try:
-                self.parent_request.child_requests.remove(self)
-            except KeyError:
-                pass
+            child_requests = self.parent_request.child_requests
+            if child_requests:
+                child_requests.discard(self)
             # self.parent_request.lock.release()
             if self.prio - 1 < self.parent_request.prio:
                 self.parent_request.prio = self.prio - 1
@@ -715,11 +1682,16 @@ class Request(object):
         #for l in waiting_locks:
         #  l.release()
 
-        for c in callbacks_finish:
-            # call the callback tuples
-            c[0](self, **c[1])
+        try:
+            for c in callbacks_finish:
+                # call the callback tuples
+                c[0](self, **c[1])
+        finally:
+            cur_tr.current_request = req_backup
 
-        cur_tr.current_request = req_backup
+            inflight = self._inflight # may be reset by another thread
+            if inflight is not None:
+                inflight._requestDone(self)
 
     #
     #
@@ -751,9 +1723,47 @@ class Request(object):
     def clean(self):
         self.kwargs = {}
         self.result = None
-        self.callbacks_finish = []
-        self.callbacks_cancel = []
+        self.callbacks_finish = ()
+        self.callbacks_cancel = ()
+        self.callbacks_failure = ()
 
 
     def getResult(self):
         return self.result
+
+
+# create a  globalmachine instance, after all classes
+# that are used by its workers are defined
+global_thread_pool = ThreadPool()
+
+_ioThreadPool = None
+_ioThreadPoolLock = threading.Lock()
+
+def ioThreadPool():
+    """
+    Return the ThreadPool that executes the requests of I/O bound
+    operators (see Operator.executeInIOPool), so that blocking reads
+    do not occupy the workers of the compute pools. The pool is
+    created on first use, its number of workers is given by the
+    LAZYFLOW_IO_THREAD_COUNT environment variable and defaults to 4.
+    """
+    global _ioThreadPool
+    if _ioThreadPool is None:
+        _ioThreadPoolLock.acquire()
+        if _ioThreadPool is None:
+            if os.environ.has_key("LAZYFLOW_IO_THREAD_COUNT"):
+                numThreads = int(os.environ["LAZYFLOW_IO_THREAD_COUNT"])
+            else:
+                numThreads = 4
+            _ioThreadPool = ThreadPool(numThreads)
+        _ioThreadPoolLock.release()
+    return _ioThreadPool
+
+if os.environ.has_key("LAZYFLOW_MEMORY_BUDGET"):
+    global_memory_budget = MemoryBudget(int(os.environ["LAZYFLOW_MEMORY_BUDGET"]) * 1024**2)
+else:
+    global_memory_budget = MemoryBudget()
+
+if os.environ.has_key("LAZYFLOW_WATCHDOG"):
+    from watchdog import Watchdog
+    global_watchdog = Watchdog(float(os.environ["LAZYFLOW_WATCHDOG"])).start()
@@ -9,6 +9,13 @@ class SlotType( object ):
     def allocateDestination( self, roi ):
         pass
 
+    def destinationSize( self, roi ):
+        """
+        estimated number of bytes of the destination that
+        allocateDestination returns for the roi.
+        """
+        return 0
+
     def writeIntoDestination( self, destination, value, roi ):
         pass
 
@@ -72,6 +79,12 @@ class ArrayLike( SlotType ):
         #     #storage.axistags = copy.copy(self.axistags)
         return storage
 
+    def destinationSize( self, roi ):
+        shape = roi.stop - roi.start if roi else self.slot.meta.shape
+        if shape is None or self.slot.meta.dtype is None:
+            return 0
+        return int(numpy.prod(shape)) * numpy.dtype(self.slot.meta.dtype).itemsize
+
     def writeIntoDestination( self, destination, value, roi ):
         if destination is not None:
             if not isinstance(destination, list):
@@ -0,0 +1,184 @@
+"""
+This module provides a watchdog thread that detects stalled
+ThreadPools and reports what their requests are waiting for.
+
+Basic usage example:
+
+---
+from lazyflow.watchdog import Watchdog
+
+watchdog = Watchdog(threshold = 60).start()
+...
+watchdog.stop()
+---
+
+A ThreadPool is considered stalled if it has submitted requests
+that are not completed, but none of its workers switched to a
+greenlet and no request was completed for threshold seconds. This
+happens when all workers are blocked, e.g. because an operator
+waits for a child request while it holds a threading.Lock that
+the child needs. A request that computes for longer than the
+threshold without waiting is reported as well, so the threshold
+should be larger than the longest expected execute() call.
+
+The report of a stalled pool lists the stacks of its workers, the
+tree of the requests that are executing or suspended, the holders
+of request.Lock objects and the stacks of the suspended greenlets.
+It is logged as an error, or passed to the callback of the watchdog.
+
+If the LAZYFLOW_WATCHDOG environment variable is set, a watchdog
+with a threshold of that many seconds is started when lazyflow.request
+is imported.
+"""
+
+import gc
+import sys
+import time
+import logging
+import threading
+import traceback
+import weakref
+
+from lazyflow.request import ThreadPool, CustomGreenlet, Lock
+
+
+def _requestState(request):
+    if request.finished:
+        return "finished"
+    if request.canceled:
+        return "canceled"
+    if request.started:
+        return "started"
+    if request.running:
+        return "queued"
+    return "created"
+
+def _formatStack(frame):
+    return "".join(traceback.format_stack(frame))
+
+
+class Watchdog(threading.Thread):
+    """
+    Daemon thread that checks all ThreadPools every interval
+    seconds and reports each stall once.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, threshold = 60.0, interval = None, callback = None):
+        """
+        Arguments:
+          threshold : seconds without progress after which a pool is reported
+          interval  : seconds between two checks, defaults to a tenth of the threshold
+          callback  : called with the pool and the report of a stall,
+                      defaults to logging the report
+        """
+        threading.Thread.__init__(self, name = "lazyflow watchdog")
+        self.daemon = True
+        self.threshold = threshold
+        self.interval = interval if interval is not None else threshold / 10.0
+        self.callback = callback
+        self._stopEvent = threading.Event()
+        self._progress = weakref.WeakKeyDictionary() # pool -> (progress counter, time of the last change, reported)
+
+    def start(self):
+        threading.Thread.start(self)
+        return self
+
+    def stop(self):
+        self._stopEvent.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        while not self._stopEvent.wait(self.interval):
+            self.check()
+
+    def check(self, now = None):
+        """
+        Check all ThreadPools and report the newly stalled ones.
+
+        Returns the list of pools that are stalled.
+        """
+        if now is None:
+            now = time.time()
+        stalled = []
+        for pool in list(ThreadPool._instances):
+            progress = pool._completedCount + sum(w.switches for w in list(pool.workers))
+            last = self._progress.get(pool)
+            if pool._inflightCount == 0 or last is None or last[0] != progress:
+                self._progress[pool] = (progress, now, False)
+                continue
+            if now - last[1] < self.threshold:
+                continue
+            stalled.append(pool)
+            if not last[2]:
+                self._progress[pool] = (progress, last[1], True)
+                self._report(pool, self.report(pool, now - last[1]))
+        return stalled
+
+    def _report(self, pool, report):
+        if self.callback is not None:
+            self.callback(pool, report)
+        else:
+            self.logger.error(report)
+
+    def report(self, pool, duration = 0):
+        """
+        Describe the state of the pool and of its requests.
+        """
+        lines = ["ThreadPool %r made no progress for %.1f seconds: "
+                 "%d requests in flight, %d queued" % (pool, duration, pool._inflightCount,
+                                                       len(pool._queue) + sum(len(w.requests) for w in list(pool.workers)))]
+
+        frames = sys._current_frames()
+        lines.append("")
+        lines.append("Workers:")
+        for w in sorted(pool.workers, key = lambda w: w.wid):
+            state = "busy" if w.processing else "idle"
+            lines.append("  Worker %d (%s, %d unfinished greenlets), last request %s" % (
+                w.wid, state, w._liveGreenlets,
+                w.current_request.describe(details = True) if w.current_request is not None else None))
+            frame = frames.get(w.ident)
+            if frame is not None:
+                lines.append(self._indent(_formatStack(frame), 4))
+
+        greenlets = [o for o in gc.get_objects() if isinstance(o, CustomGreenlet)
+                     and getattr(o, "request", None) is not None
+                     and getattr(o, "thread", None) in pool.workers]
+        requests = set(gr.request for gr in greenlets)
+        requests.update(w.current_request for w in pool.workers if w.current_request is not None)
+
+        lines.append("")
+        lines.append("Request tree:")
+        roots = set()
+        for request in requests:
+            while request.parent_request is not None:
+                request = request.parent_request
+            roots.add(request)
+        for root in roots:
+            self._formatTree(root, requests, lines, 1)
+
+        lines.append("")
+        lines.append("Held request.Locks:")
+        for lock in [o for o in gc.get_objects() if isinstance(o, Lock) and o.owner is not None]:
+            owner = lock.owner
+            holder = owner.request.describe(details = True) if getattr(owner, "request", None) is not None else owner
+            lines.append("  Lock 0x%x held by %s, %d waiting" % (id(lock), holder, len(lock.waiting)))
+
+        lines.append("")
+        lines.append("Suspended greenlets:")
+        for gr in greenlets:
+            if gr.gr_frame is not None:
+                lines.append("  %s on Worker %d" % (gr.request.describe(details = True), gr.thread.wid))
+                lines.append(self._indent(_formatStack(gr.gr_frame), 4))
+        return "\n".join(lines)
+
+    def _formatTree(self, request, active, lines, depth):
+        marker = "*" if request in active else " "
+        lines.append("%s%s %s [%s]" % ("  " * depth, marker, request.describe(details = True), _requestState(request)))
+        for child in list(request.child_requests):
+            self._formatTree(child, active, lines, depth + 1)
+
+    def _indent(self, text, n):
+        return "\n".join(" " * n + line for line in text.rstrip().splitlines())
@@ -0,0 +1,126 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import numpy
+from lazyflow import affinity
+from lazyflow import request
+from lazyflow.request import Request, ThreadPool
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper, OpArrayCache
+
+class TestAffinity(object):
+
+    def setUp(self):
+        self.sysfs = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.sysfs)
+
+    def _write(self, path, text):
+        path = os.path.join(self.sysfs, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(text)
+
+    def test_parseCpuList(self):
+        assert affinity._parseCpuList("0-3,8-9,12\n") == [0, 1, 2, 3, 8, 9, 12]
+        assert affinity._parseCpuList("5") == [5]
+        assert affinity._parseCpuList("\n") == []
+
+    def test_cpuGroups(self):
+        allowed = affinity.allowedCpus()
+        assert len(allowed) > 0
+        # without topology information all cpus form one group
+        assert affinity.cpuGroups(sysfs = self.sysfs) == [allowed]
+
+        # groups are restricted to the allowed cpus
+        self._write("node/node0/cpulist", "%d\n" % allowed[0])
+        self._write("node/node1/cpulist", "%d-%d\n" % (allowed[-1] + 1, allowed[-1] + 4))
+        assert affinity.cpuGroups(sysfs = self.sysfs) == [[allowed[0]]]
+
+    def test_cpuGroupsOfSockets(self):
+        allowed = affinity.allowedCpus()
+        for cpu in allowed:
+            self._write("cpu/cpu%d/topology/physical_package_id" % cpu, "%d\n" % (cpu % 2))
+        groups = affinity.cpuGroups(sysfs = self.sysfs)
+        assert sorted(sum(groups, [])) == allowed
+        assert len(groups) == min(2, len(allowed))
+
+    def test_workerPlacement(self):
+        groups = [[0, 1], [2, 3]]
+        assert [affinity.workerPlacement(i, "cores", groups) for i in range(5)] == \
+            [([0], 0), ([1], 0), ([2], 1), ([3], 1), ([0], 0)]
+        assert [affinity.workerPlacement(i, "groups", groups) for i in range(3)] == \
+            [([0, 1], 0), ([2, 3], 1), ([0, 1], 0)]
+
+    def test_pinCurrentThread(self):
+        allowed = affinity.allowedCpus()
+        pinned = []
+        def run():
+            if affinity.pinCurrentThread(allowed[:1]):
+                pinned.append(affinity.allowedCpus())
+        t = threading.Thread(target = run)
+        t.start()
+        t.join()
+        if pinned:
+            assert pinned[0] == allowed[:1]
+        # pinning another thread does not restrict the process
+        assert affinity.allowedCpus() == allowed
+
+
+class TestAffinityThreadPool(object):
+
+    def setUp(self):
+        # pretend the machine has two groups that share the first cpu
+        self.cpuGroups = request.cpuGroups
+        cpu = affinity.allowedCpus()[0]
+        request.cpuGroups = lambda: [[cpu], [cpu]]
+        self.threadPool = ThreadPool(2, affinity = "groups")
+
+    def tearDown(self):
+        request.cpuGroups = self.cpuGroups
+        self.threadPool.stopThreadPool()
+
+    def test_placement(self):
+        assert sorted(w.cpuGroup for w in self.threadPool.workers) == [0, 1]
+        assert sorted(self.threadPool._groupWorkers.keys()) == [0, 1]
+
+        # without affinity the workers are not placed
+        threadPool = ThreadPool(1)
+        assert threadPool._groupWorkers is None
+        assert list(threadPool.workers)[0].cpus is None
+        threadPool.stopThreadPool()
+
+    def test_groupRequests(self):
+        def work():
+            time.sleep(0.01)
+            return threading.current_thread().cpuGroup
+
+        for group in [1, 0, 1, 1, 0]:
+            req = Request(work)
+            req.threadPool = self.threadPool
+            req.cpuGroup = group
+            assert req.submit().wait(timeout = 10) == group
+            assert self.threadPool.drain(timeout = 10)
+            time.sleep(0.05)
+
+    def test_cacheHint(self):
+        graph = Graph()
+        graph._threadPool = self.threadPool
+        data = numpy.random.random((20, 20))
+        cache = OpArrayCache(graph = graph)
+        cache.Input.setValue(data)
+        cache.blockShape.setValue((10, 10))
+        piper = OpArrayPiper(graph = graph)
+        piper.Input.connect(cache.Output)
+        assert (piper.Output[:].wait(timeout = 10) == data).all()
+
+        # the cache remembers the group of the worker that allocated it,
+        # the readers of the cache are executed in that group
+        group = cache.cpuGroup
+        assert group in (0, 1)
+        assert piper._preferredCpuGroup() == group
+        assert piper.Output[0:5, 0:5].cpuGroup == group
@@ -0,0 +1,97 @@
+import time
+import threading
+import numpy
+import nose
+from lazyflow.graph import Graph, ValueRequest
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import Request, ThreadPool
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from lazyflow.asyncbridge import requestFuture
+
+class TestAsyncBridge(object):
+
+    def setUp(self):
+        if asyncio is None:
+            raise nose.SkipTest("neither asyncio nor trollius is installed")
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        if asyncio is not None:
+            self.loop.close()
+
+    def test_request(self):
+        def work(x):
+            time.sleep(0.01)
+            return x * 2
+
+        futures = [requestFuture(Request(work, x = i), loop = self.loop) for i in range(20)]
+        results = self.loop.run_until_complete(asyncio.gather(*futures, loop = self.loop))
+        assert list(results) == [i * 2 for i in range(20)]
+
+    def test_slotRequest(self):
+        g = Graph()
+        data = numpy.random.random((10, 20))
+        op = OpArrayPiper(graph = g)
+        op.Input.setValue(data)
+        op2 = OpArrayPiper(graph = g)
+        op2.Input.connect(op.Output)
+
+        result = self.loop.run_until_complete(requestFuture(op2.Output[2:5, :], loop = self.loop))
+        assert (result == data[2:5]).all()
+
+    def test_valueRequest(self):
+        future = requestFuture(ValueRequest(42), loop = self.loop)
+        assert self.loop.run_until_complete(future) == 42
+
+    def test_cancelFuture(self):
+        event = threading.Event()
+        def work():
+            event.wait()
+
+        req = Request(work)
+        future = requestFuture(req, loop = self.loop)
+        future.cancel()
+        # let the loop run the done callbacks of the future
+        self.loop.run_until_complete(asyncio.sleep(0, loop = self.loop))
+        event.set()
+        assert req.canceled
+
+    def test_cancelRequest(self):
+        event = threading.Event()
+        def work():
+            event.wait()
+
+        req = Request(work)
+        future = requestFuture(req, loop = self.loop)
+        req.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0, loop = self.loop))
+        event.set()
+        assert future.cancelled()
+
+    def test_failingRequest(self):
+        def work():
+            raise ValueError("failed")
+
+        # the exception still kills the worker that executes
+        # the request, do not take one from the global pool
+        threadPool = ThreadPool(1)
+        req = Request(work)
+        req.threadPool = threadPool
+        future = requestFuture(req, loop = self.loop)
+        try:
+            self.loop.run_until_complete(asyncio.wait_for(future, 10, loop = self.loop))
+            assert False, "the future should have raised"
+        except ValueError:
+            pass
+        finally:
+            # the failed request does not count as in flight anymore
+            assert threadPool.drain(timeout = 10)
+            threadPool.stopThreadPool()
@@ -0,0 +1,58 @@
+import os
+import json
+import tempfile
+import numpy
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import Request
+from lazyflow.chrometrace import ChromeTrace
+
+class TestChromeTrace(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.data = numpy.random.random((10, 20))
+        self.op1 = OpArrayPiper(graph = self.graph)
+        self.op1.Input.setValue(self.data)
+        self.op2 = OpArrayPiper(graph = self.graph)
+        self.op2.Input.connect(self.op1.Output)
+
+    def test_operatorSpans(self):
+        with ChromeTrace() as trace:
+            result = self.op2.Output[0:5, :].wait()
+        assert not Request.EnableInstrumentation
+        assert Request.tracer is None
+        assert (result == self.data[0:5]).all()
+
+        events = trace.events()
+        begins = [e for e in events if e["ph"] == "b" and e["name"] != "wait"]
+        ends = [e for e in events if e["ph"] == "e" and e["name"] != "wait"]
+        names = [e["name"] for e in begins]
+        assert "%s.Output" % self.op2.name in names
+        assert len(begins) == len(ends)
+        for e in begins:
+            assert "roi" in e["args"]
+        # the request of op1 is a child of the request of op2
+        ids = set(e["id"] for e in begins)
+        assert any(e["args"]["parent"] in ids for e in begins)
+        assert any(e["ph"] == "M" for e in events)
+
+    def test_save(self):
+        def work():
+            return 42
+
+        with ChromeTrace() as trace:
+            req = Request(work)
+            req.submit()
+            req.wait()
+
+        fd, filename = tempfile.mkstemp(suffix = ".json")
+        os.close(fd)
+        try:
+            trace.save(filename)
+            with open(filename) as f:
+                data = json.load(f)
+        finally:
+            os.remove(filename)
+        names = [e["name"] for e in data["traceEvents"]]
+        assert "work" in names
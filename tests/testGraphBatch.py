@@ -0,0 +1,111 @@
+import threading
+import numpy
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper, OpArrayCache
+
+class OpArrayPiperWithDirtyRois(OpArrayPiper):
+    """
+    An array piper that records the dirty rois it receives.
+    """
+    def __init__(self, *args, **kwargs):
+        super(OpArrayPiperWithDirtyRois, self).__init__(*args, **kwargs)
+        self.dirtyRois = []
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.dirtyRois.append((tuple(roi.start), tuple(roi.stop)))
+        super(OpArrayPiperWithDirtyRois, self).propagateDirty(slot, subindex, roi)
+
+class TestGraphBatch(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.data = numpy.zeros((20, 20))
+        self.source = OpArrayPiper(graph = self.graph)
+        self.source.Input.setValue(self.data)
+        self.counter = OpArrayPiperWithDirtyRois(graph = self.graph)
+        self.counter.Input.connect(self.source.Output)
+        self.downstream = OpArrayPiperWithDirtyRois(graph = self.graph)
+        self.downstream.Input.connect(self.counter.Output)
+        self.dirtySignals = []
+        self.downstream.Output.notifyDirty(lambda slot, roi: self.dirtySignals.append(roi))
+
+    def test_withoutBatch(self):
+        self.source.Output.setDirty((slice(0, 2), slice(0, 2)))
+        self.source.Output.setDirty((slice(1, 3), slice(0, 2)))
+        assert self.counter.dirtyRois == [((0, 0), (2, 2)), ((1, 0), (3, 2))]
+        assert len(self.dirtySignals) == 2
+
+    def test_mergeOverlapping(self):
+        with self.graph.batch():
+            for i in range(10):
+                self.source.Output.setDirty((slice(i, i + 2), slice(0, 2)))
+            self.source.Output.setDirty((slice(15, 20), slice(15, 20)))
+            # nothing is propagated before the batch ends
+            assert self.counter.dirtyRois == []
+            assert self.dirtySignals == []
+        assert self.counter.dirtyRois == [((0, 0), (11, 2)), ((15, 15), (20, 20))]
+        assert self.downstream.dirtyRois == self.counter.dirtyRois
+        assert len(self.dirtySignals) == 2
+
+    def test_mergeChain(self):
+        # the last roi makes the two collected ones a box
+        with self.graph.batch():
+            self.source.Output.setDirty((slice(0, 2), slice(0, 2)))
+            self.source.Output.setDirty((slice(5, 7), slice(0, 2)))
+            self.source.Output.setDirty((slice(2, 5), slice(0, 2)))
+        assert self.counter.dirtyRois == [((0, 0), (7, 2))]
+
+    def test_keepSeparateRois(self):
+        # the bounding box of these rois contains clean data
+        with self.graph.batch():
+            self.source.Output.setDirty((slice(0, 2), slice(0, 2)))
+            self.source.Output.setDirty((slice(1, 6), slice(1, 3)))
+            self.source.Output.setDirty((slice(0, 1), slice(0, 1)))
+        assert self.counter.dirtyRois == [((0, 0), (2, 2)), ((1, 1), (6, 3))]
+
+    def test_otherThreads(self):
+        # a batch does not defer the notifications of other threads
+        with self.graph.batch():
+            thread = threading.Thread(target = self.source.Output.setDirty,
+                                      args = ((slice(0, 2), slice(0, 2)),))
+            thread.start()
+            thread.join()
+            assert self.counter.dirtyRois == [((0, 0), (2, 2))]
+            self.source.Output.setDirty((slice(4, 5), slice(0, 2)))
+            assert self.counter.dirtyRois == [((0, 0), (2, 2))]
+        assert self.counter.dirtyRois == [((0, 0), (2, 2)), ((4, 0), (5, 2))]
+
+    def test_nested(self):
+        with self.graph.batch():
+            with self.graph.batch():
+                self.source.Output.setDirty((slice(0, 2), slice(0, 2)))
+            assert self.counter.dirtyRois == []
+            self.source.Output.setDirty((slice(0, 2), slice(0, 2)))
+        assert self.counter.dirtyRois == [((0, 0), (2, 2))]
+
+        # dirty notifications after the batch are propagated immediately
+        self.source.Output.setDirty((slice(4, 5), slice(0, 2)))
+        assert self.counter.dirtyRois[1:] == [((4, 0), (5, 2))]
+
+    def test_exception(self):
+        try:
+            with self.graph.batch():
+                self.source.Output.setDirty((slice(0, 2), slice(0, 2)))
+                raise ValueError()
+        except ValueError:
+            pass
+        assert self.counter.dirtyRois == [((0, 0), (2, 2))]
+        assert self.graph._batchDepth == 0
+
+    def test_cache(self):
+        cache = OpArrayCache(graph = self.graph)
+        cache.Input.connect(self.source.Output)
+        cache.blockShape.setValue((5, 5))
+        assert (cache.Output[:].wait() == 0).all()
+
+        self.data[:] = 1
+        with self.graph.batch():
+            for i in range(5):
+                self.source.Output.setDirty((slice(i, i + 1), slice(0, 20)))
+        assert (cache.Output[0:5, :].wait() == 1).all()
+        assert (cache.Output[5:, :].wait() == 0).all()
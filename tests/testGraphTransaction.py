@@ -0,0 +1,123 @@
+import threading
+import numpy
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
+from lazyflow.operators import OpArrayPiper
+
+class OpArrayPiperWithSetups(OpArrayPiper):
+    """
+    An array piper that adds an offset to its input and records
+    the calls of setupOutputs.
+    """
+    Offset = InputSlot(value = 0)
+
+    def __init__(self, setups, *args, **kwargs):
+        self._setups = setups
+        super(OpArrayPiperWithSetups, self).__init__(*args, **kwargs)
+
+    def setupOutputs(self):
+        self._setups.append(self)
+        super(OpArrayPiperWithSetups, self).setupOutputs()
+
+    def execute(self, slot, subindex, roi, result):
+        super(OpArrayPiperWithSetups, self).execute(slot, subindex, roi, result)
+        result += self.Offset.value
+        return result
+
+class OpInnerGraph(Operator):
+    """
+    Builds an inner operator in setupOutputs and reads its output meta.
+    """
+    name = "OpInnerGraph"
+
+    Input = InputSlot()
+    Output = OutputSlot()
+
+    def __init__(self, setups, *args, **kwargs):
+        super(OpInnerGraph, self).__init__(*args, **kwargs)
+        self.inner = OpArrayPiperWithSetups(setups, parent = self)
+        self.Output.connect(self.inner.Output)
+
+    def setupOutputs(self):
+        self.inner.Offset.setValue(1)
+        self.inner.Input.connect(self.Input)
+        assert self.inner.Output.meta.shape == self.Input.meta.shape
+
+    def execute(self, slot, subindex, roi, result):
+        assert False
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+class TestGraphTransaction(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.setups = []
+        self.data = numpy.arange(20.0)
+        self.ops = [OpArrayPiperWithSetups(self.setups, graph = self.graph) for i in range(3)]
+        self.ops[1].Input.connect(self.ops[0].Output)
+        self.ops[2].Input.connect(self.ops[1].Output)
+
+    def test_withoutTransaction(self):
+        self.ops[0].Input.setValue(self.data)
+        self.ops[0].Offset.setValue(1)
+        self.ops[1].Offset.setValue(2)
+        assert len(self.setups) > 3
+
+    def test_transaction(self):
+        with self.graph.transaction():
+            self.ops[0].Input.setValue(self.data)
+            self.ops[0].Offset.setValue(1)
+            self.ops[1].Offset.setValue(2)
+            self.ops[2].Offset.setValue(3)
+            assert self.setups == []
+        assert self.setups == self.ops
+        assert (self.ops[2].Output[:].wait() == self.data + 6).all()
+
+    def test_topologicalOrder(self):
+        # the downstream operators are changed first
+        with self.graph.transaction():
+            self.ops[2].Offset.setValue(3)
+            self.ops[1].Offset.setValue(2)
+            self.ops[0].Input.setValue(self.data)
+        assert self.setups == self.ops
+
+    def test_nested(self):
+        with self.graph.transaction():
+            with self.graph.transaction():
+                self.ops[0].Input.setValue(self.data)
+            assert self.setups == []
+            self.ops[1].Offset.setValue(2)
+        assert self.setups == self.ops
+
+        # after the transaction operators are set up immediately
+        del self.setups[:]
+        self.ops[2].Offset.setValue(3)
+        assert self.setups == [self.ops[2]]
+
+    def test_newOperators(self):
+        with self.graph.transaction():
+            self.ops[0].Input.setValue(self.data)
+            op = OpArrayPiperWithSetups(self.setups, graph = self.graph)
+            op.Input.connect(self.ops[2].Output)
+        assert self.setups == self.ops + [op]
+        assert op.Output.meta.shape == self.data.shape
+
+    def test_innerGraph(self):
+        inner = OpInnerGraph(self.setups, graph = self.graph)
+        with self.graph.transaction():
+            inner.Input.connect(self.ops[2].Output)
+            self.ops[0].Input.setValue(self.data)
+        assert self.setups == self.ops + [inner.inner]
+        assert (inner.Output[:].wait() == self.data + 1).all()
+
+    def test_otherThreads(self):
+        # a transaction does not defer the setupOutputs calls of other threads
+        with self.graph.transaction():
+            thread = threading.Thread(target = self.ops[0].Input.setValue, args = (self.data,))
+            thread.start()
+            thread.join()
+            assert self.setups == self.ops
+            self.ops[1].Offset.setValue(2)
+            assert self.setups == self.ops
+        assert self.setups == self.ops + self.ops[1:]
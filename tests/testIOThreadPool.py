@@ -0,0 +1,76 @@
+import threading
+import numpy
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import ioThreadPool
+
+class OpArrayPiperWithThreads(OpArrayPiper):
+    """
+    An array piper that records the threads that execute it.
+    """
+    def __init__(self, *args, **kwargs):
+        super(OpArrayPiperWithThreads, self).__init__(*args, **kwargs)
+        self.threads = []
+
+    def execute(self, slot, subindex, roi, result):
+        self.threads.append(threading.current_thread())
+        return super(OpArrayPiperWithThreads, self).execute(slot, subindex, roi, result)
+
+class OpBlockingReader(OpArrayPiperWithThreads):
+    """
+    Pretends to read its input from a slow disk: execute()
+    blocks until the proceed event is set.
+    """
+    executeInIOPool = True
+
+    def __init__(self, *args, **kwargs):
+        super(OpBlockingReader, self).__init__(*args, **kwargs)
+        self.proceed = threading.Event()
+
+    def execute(self, slot, subindex, roi, result):
+        self.proceed.wait()
+        return super(OpBlockingReader, self).execute(slot, subindex, roi, result)
+
+class TestIOThreadPool(object):
+
+    def setUp(self):
+        # a single compute worker, that must not be blocked by the reader
+        self.graph = Graph(numThreads = 1)
+        self.data = numpy.random.random((10, 20))
+        self.reader = OpBlockingReader(graph = self.graph)
+        self.reader.Input.setValue(self.data)
+        self.piper = OpArrayPiper(graph = self.graph)
+        self.piper.Input.connect(self.reader.Output)
+        self.other = OpArrayPiper(graph = self.graph)
+        self.other.Input.setValue(self.data)
+
+    def tearDown(self):
+        self.reader.proceed.set()
+        self.graph.finalize()
+
+    def test_readerRunsInIOPool(self):
+        req = self.piper.Output[0:5, :]
+        req.submit()
+
+        # the compute worker keeps executing other requests
+        # while the read is blocked
+        result = self.other.Output[2:4, :]
+        result.submit()
+        assert (result.wait(timeout = 10) == self.data[2:4]).all()
+
+        self.reader.proceed.set()
+        assert (req.wait(timeout = 10) == self.data[0:5]).all()
+        assert len(self.reader.threads) == 1
+        assert self.reader.threads[0] in ioThreadPool().workers
+
+    def test_computeInputsLeaveIOPool(self):
+        # the inputs that a reader requests are computed by the compute workers
+        recorder = OpArrayPiperWithThreads(graph = self.graph)
+        recorder.Input.setValue(self.data)
+        reader = OpBlockingReader(graph = self.graph)
+        reader.Input.connect(recorder.Output)
+        reader.proceed.set()
+        assert (reader.Output[0:5, :].wait(timeout = 10) == self.data[0:5]).all()
+        assert reader.threads[0] in ioThreadPool().workers
+        assert len(recorder.threads) == 1
+        assert recorder.threads[0] in self.graph.threadPool.workers
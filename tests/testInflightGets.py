@@ -0,0 +1,116 @@
+import threading
+import numpy
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import Pool
+
+class OpBlockingArrayPiper(OpArrayPiper):
+    """
+    An array piper that counts how many times its execute function has been called,
+    execute blocks until the proceed event is set.
+    """
+    cheapExecute = False # coalesce the identical gets of the output
+
+    def __init__(self, *args, **kwargs):
+        super(OpBlockingArrayPiper, self).__init__(*args, **kwargs)
+        self.accessCount = 0
+        self.proceed = threading.Event()
+        self._lock = threading.Lock()
+
+    def execute(self, slot, subindex, roi, result):
+        with self._lock:
+            self.accessCount += 1
+        self.proceed.wait()
+        return super(OpBlockingArrayPiper, self).execute(slot, subindex, roi, result)
+
+class TestInflightGets(object):
+
+    def setUp(self):
+        self.graph = Graph(numThreads = 3)
+        self.data = numpy.random.random((10, 20))
+        self.op = OpBlockingArrayPiper(graph = self.graph)
+        self.op.Input.setValue(self.data)
+
+    def tearDown(self):
+        self.op.proceed.set()
+        self.graph.finalize()
+
+    def test_identicalRequestsShareExecution(self):
+        destination = numpy.zeros((5, 20))
+        req1 = self.op.Output[0:5, :].submit()
+        req2 = self.op.Output[0:5, :]
+        req2.writeInto(destination)
+        req2.submit()
+        req3 = self.op.Output[0:5, :].submit()
+
+        self.op.proceed.set()
+        result1 = req1.wait()
+        result2 = req2.wait()
+        result3 = req3.wait()
+        assert self.op.accessCount == 1
+        assert (result1 == self.data[0:5]).all()
+        assert result2 is destination
+        assert (destination == self.data[0:5]).all()
+        # followers get their own copy of the data
+        assert result3 is not result1
+        assert (result3 == self.data[0:5]).all()
+
+    def test_differentRoisExecuteSeparately(self):
+        req1 = self.op.Output[0:5, :].submit()
+        req2 = self.op.Output[0:6, :].submit()
+        self.op.proceed.set()
+        req1.wait()
+        req2.wait()
+        assert self.op.accessCount == 2
+
+    def test_dirtyForgetsInflightRequests(self):
+        req1 = self.op.Output[0:5, :].submit()
+        self.op.Output.setDirty(slice(None))
+        req2 = self.op.Output[0:5, :].submit()
+        self.op.proceed.set()
+        req1.wait()
+        req2.wait()
+        assert self.op.accessCount == 2
+
+    def test_finishedRequestsAreForgotten(self):
+        self.op.proceed.set()
+        self.op.Output[0:5, :].wait()
+        self.op.Output[0:5, :].wait()
+        assert self.op.accessCount == 2
+
+    def test_followedRequestIsNotCancelled(self):
+        req1 = self.op.Output[0:5, :].submit()
+        req2 = self.op.Output[0:5, :].submit()
+        req1.cancel()
+        assert not req1.canceled
+        self.op.proceed.set()
+        assert (req2.wait() == self.data[0:5]).all()
+        assert self.op.accessCount == 1
+
+    def test_leaderCanBeCancelledAfterFollowersFinished(self):
+        req1 = self.op.Output[0:5, :].submit()
+        req2 = self.op.Output[0:5, :].submit()
+        self.op.proceed.set()
+        assert (req2.wait() == self.data[0:5]).all()
+        req1.wait()
+        # the finished follower no longer protects the leader
+        assert req1.function.followers == 0
+        key = ((0, 0), (5, 20))
+        assert self.graph._cancelInflightGet(req1, self.op.Output, key)
+
+    def test_cancelLeaderAfterRefusalInPool(self):
+        leader = self.op.Output[0:5, :]
+        follower = self.op.Output[0:5, :]
+        pool = Pool()
+        pool.add(leader)
+        pool.add(follower)
+        pool.submit()
+
+        # refused while the follower waits, the callbacks are kept
+        leader.cancel()
+        assert not leader.canceled
+        follower.cancel()
+        leader.cancel()
+        assert leader.canceled
+        assert follower.canceled
+        assert pool.finished
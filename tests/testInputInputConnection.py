@@ -133,6 +133,46 @@ class TestMultiInputInputConnection(object):
         assert self.op.internalOp.Output[0].meta.shape is not None
         assert self.op.internalOp.Output[0].value == 1
 
+class TestInputChainProvider(object):
+
+    def setUp(self):
+        self.g = Graph()
+        self.source = OpB(graph=self.g)
+        self.source.Input.setValue(1)
+        self.ops = [OpB(graph=self.g) for i in range(3)]
+        self.ops[0].Input.connect(self.source.Output)
+        for i in range(1, len(self.ops)):
+            self.ops[i].Input.connect(self.ops[i-1].Input)
+
+    def tearDown(self):
+        self.g.stopGraph()
+
+    def test_provider(self):
+        assert self.ops[-1].Input[:].allocate().wait()[0] == 1
+        # the request skips the input slots in between
+        assert self.ops[-1].Input._provider is self.source.Output
+
+    def test_reconnect(self):
+        assert self.ops[-1].Input[:].allocate().wait()[0] == 1
+        other = OpB(graph=self.g)
+        other.Input.setValue(2)
+        self.ops[0].Input.disconnect()
+        self.ops[0].Input.connect(other.Output)
+        assert self.ops[-1].Input[:].allocate().wait()[0] == 2
+        assert self.ops[-1].Input._provider is other.Output
+
+        self.ops[1].Input.disconnect()
+        self.ops[1].Input.setValue(3)
+        assert self.ops[-1].Input[:].allocate().wait()[0] == 3
+
+    def test_deepChain(self):
+        # deeper than the recursion limit
+        ops = [OpB(graph=self.g) for i in range(1200)]
+        ops[0].Input.connect(self.source.Output)
+        for i in range(1, len(ops)):
+            ops[i].Input.connect(ops[i-1].Input)
+        assert ops[-1].Input[:].allocate().wait()[0] == 1
+
 if __name__ == "__main__":
     import sys
     import nose
@@ -0,0 +1,99 @@
+import threading
+import numpy
+from lazyflow.graph import Graph
+from lazyflow.operators import OpArrayPiper
+from lazyflow.request import Request, ThreadPool, MemoryBudget, global_memory_budget
+
+class OpArrayPiperWithRois(OpArrayPiper):
+    """
+    An array piper that records the rois of its execute calls.
+    """
+    def __init__(self, *args, **kwargs):
+        super(OpArrayPiperWithRois, self).__init__(*args, **kwargs)
+        self.rois = []
+
+    def execute(self, slot, subindex, roi, result):
+        self.rois.append((tuple(roi.start), tuple(roi.stop)))
+        return super(OpArrayPiperWithRois, self).execute(slot, subindex, roi, result)
+
+class TestMemoryBudget(object):
+
+    def setUp(self):
+        self.graph = Graph()
+        self.data = numpy.random.random((10, 20))
+        self.op = OpArrayPiperWithRois(graph = self.graph)
+        self.op.Input.setValue(self.data)
+
+    def tearDown(self):
+        global_memory_budget.setLimit(None)
+
+    def test_disabledByDefault(self):
+        assert global_memory_budget.limit is None
+        result = self.op.Output[:].wait()
+        assert (result == self.data).all()
+        assert self.op.rois == [((0, 0), (10, 20))]
+        assert global_memory_budget.outstanding == 0
+
+    def test_largeRequestIsSplit(self):
+        # the full output needs 1600 bytes, the chunks at most half the limit
+        global_memory_budget.setLimit(800)
+        result = self.op.Output[:].wait()
+        assert (result == self.data).all()
+        assert len(self.op.rois) == 5
+        assert self.op.rois[0] == ((0, 0), (2, 20))
+        assert self.op.rois[-1] == ((8, 0), (10, 20))
+        assert global_memory_budget.outstanding == 0
+
+        result = self.op.Output[2:4, :].wait()
+        assert (result == self.data[2:4]).all()
+        assert self.op.rois[-1] == ((2, 0), (4, 20))
+        assert global_memory_budget.outstanding == 0
+
+    def test_givenDestinationIsSplit(self):
+        # the chunks are written into views of the destination of the caller
+        global_memory_budget.setLimit(800)
+        destination = numpy.zeros((10, 20))
+        result = self.op.Output[:].writeInto(destination).wait()
+        assert result is destination
+        assert (destination == self.data).all()
+        assert len(self.op.rois) == 5
+        assert global_memory_budget.outstanding == 0
+
+    def test_reserveBlocks(self):
+        budget = MemoryBudget(300)
+        threadPool = ThreadPool(4)
+        admitted = []
+        proceed = threading.Event()
+
+        def work(i):
+            budget.reserve(100)
+            admitted.append(i)
+            proceed.wait()
+            budget.release(100)
+
+        requests = []
+        for i in range(5):
+            req = Request(work, i = i)
+            req.threadPool = threadPool
+            requests.append(req.submit())
+
+        threadPool.drain(timeout = 0.1)
+        assert len(admitted) == 3
+        assert budget.outstanding == 300
+
+        proceed.set()
+        for req in requests:
+            req.wait()
+        threadPool.stopThreadPool()
+        assert sorted(admitted) == range(5)
+        assert budget.outstanding == 0
+
+    def test_oversizedReservation(self):
+        budget = MemoryBudget(100)
+        budget.reserve(1000)
+        assert budget.outstanding == 1000
+        budget.release(1000)
+        budget.reserve(50)
+        # child requests are counted, but never wait
+        budget.reserve(1000, block = False)
+        assert budget.outstanding == 1050
@@ -0,0 +1,87 @@
+import copy
+import pickle
+import numpy
+from lazyflow.graph import MetaDict
+
+class TestMetaDict(object):
+
+    def setUp(self):
+        self.meta = MetaDict()
+        self.meta.shape = (1, 2, 3)
+        self.meta.dtype = numpy.uint8
+        self.meta.drange = (0, 255)
+
+    def test_access(self):
+        meta = self.meta
+        assert meta.shape == (1, 2, 3)
+        assert meta["shape"] == (1, 2, 3)
+        assert meta.drange == (0, 255)
+        assert meta.axistags is None
+        assert meta.description is None
+        assert meta["description"] is None
+        assert sorted(meta.keys()) == ["_dirty", "_ready", "drange", "dtype", "shape"]
+
+    def test_mirroredEntries(self):
+        meta = self.meta
+        meta["shape"] = (4,)
+        assert meta.shape == (4,)
+        del meta["shape"]
+        assert meta.shape is None
+        assert "shape" not in meta
+        meta.update(shape = (5,), axistags = "xyz")
+        assert meta.shape == (5,)
+        assert meta.axistags == "xyz"
+        assert meta.pop("axistags") == "xyz"
+        assert meta.axistags is None
+        meta.setdefault("axistags", "t")
+        assert meta.axistags == "t"
+        meta.clear()
+        assert meta.shape is None
+        assert meta._dirty is None
+
+    def test_dirty(self):
+        meta = self.meta
+        meta._dirty = False
+        meta.shape = (1, 2, 3)
+        assert meta._dirty is False
+        meta.shape = (1, 2)
+        assert meta._dirty is True
+
+        meta._dirty = False
+        meta.data = numpy.zeros(3)
+        meta.data = numpy.ones(3)
+        assert meta._dirty is True
+
+    def test_copy(self):
+        meta = self.meta
+        meta._ready = True
+        meta._dirty = False
+        other = meta.copy()
+        assert isinstance(other, MetaDict)
+        assert other.shape == meta.shape
+        assert other._ready is True
+        assert other._dirty is True
+        other.shape = (7,)
+        assert meta.shape == (1, 2, 3)
+
+    def test_assignFrom(self):
+        meta = self.meta
+        meta.tags = [1, 2]
+        other = MetaDict()
+        other._dirty = False
+        other.assignFrom(meta)
+        assert other.shape == meta.shape
+        assert other.dtype is meta.dtype
+        assert other._dirty is True
+        # readiness is not assigned
+        assert other._ready is False
+        # mutable values are copied
+        assert other.tags == meta.tags and other.tags is not meta.tags
+
+    def test_pickle(self):
+        self.meta._dirty = False
+        for other in [copy.copy(self.meta), pickle.loads(pickle.dumps(self.meta, 2))]:
+            assert isinstance(other, MetaDict)
+            assert other == self.meta
+            assert other.shape == (1, 2, 3)
+            assert other._dirty is False
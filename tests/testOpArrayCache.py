@@ -1,3 +1,4 @@
+import time
 import threading
 import numpy
 import vigra
@@ -25,6 +26,20 @@ class OpArrayPiperWithAccessCount(OpArrayPiper):
         super(OpArrayPiperWithAccessCount, self).execute(slot, subindex, roi, result)
         
 
+class OpBlockingArrayPiper(OpArrayPiperWithAccessCount):
+    """
+    An array piper whose execute function blocks until the proceed event is set.
+    """
+    def __init__(self, *args, **kwargs):
+        super(OpBlockingArrayPiper, self).__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+
+    def execute(self, slot, subindex, roi, result):
+        self.started.set()
+        self.proceed.wait()
+        super(OpBlockingArrayPiper, self).execute(slot, subindex, roi, result)
+
 class TestOpArrayCache(object):
 
     def setUp(self):
@@ -208,6 +223,88 @@ class TestOpArrayCache(object):
         assert (data == self.data[slicing]).all()
         assert opProvider.accessCount == expectedAccessCount
 
+class TestOpArrayCacheCancel(object):
+
+    def setUp(self):
+        self.dataShape = (1,100,100,10,1)
+        self.data = (numpy.random.random(self.dataShape) * 100).astype(int)
+        self.data = self.data.view(vigra.VigraArray)
+        self.data.axistags = vigra.defaultAxistags('txyzc')
+
+        self.graph = Graph(numThreads = 2)
+        opProvider = OpBlockingArrayPiper(graph=self.graph)
+        opProvider.Input.setValue(self.data)
+        self.opProvider = opProvider
+
+        opCache = OpArrayCache(graph=self.graph)
+        opCache.Input.connect(opProvider.Output)
+        opCache.blockShape.setValue( (10,10,10,10,10) )
+        opCache.fixAtCurrent.setValue(False)
+        self.opCache = opCache
+
+    def tearDown(self):
+        self.opProvider.proceed.set()
+        self.graph.finalize()
+
+    def testCancelBlockFetch(self):
+        opCache = self.opCache
+        opProvider = self.opProvider
+
+        slicing = make_key[0:1, 0:10, 10:20, 0:10, 0:1]
+        req = opCache.Output( slicing )
+        req.submit()
+        assert opProvider.started.wait(10)
+        assert (opCache._blockState[0, 0, 1, 0, 0] == OpArrayCache.IN_PROCESS)
+
+        # nobody else waits for the block, so it is fetched again later
+        req.cancel()
+        assert req.canceled
+        assert (opCache._blockState[0, 0, 1, 0, 0] == OpArrayCache.DIRTY)
+        assert opCache._running == 0
+
+        # the running input request is not interrupted
+        opProvider.proceed.set()
+        deadline = time.time() + 10
+        while opProvider.accessCount == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert opProvider.accessCount == 1
+
+        data = opCache.Output( slicing ).wait()
+        assert (data == self.data[slicing]).all()
+        assert opProvider.accessCount == 2
+        assert (opCache._blockState[0, 0, 1, 0, 0] == OpArrayCache.CLEAN)
+
+    def testCancelSharedBlockFetch(self):
+        opCache = self.opCache
+        opProvider = self.opProvider
+
+        slicing = make_key[0:1, 0:10, 10:20, 0:10, 0:1]
+        req = opCache.Output( slicing )
+        req.submit()
+        assert opProvider.started.wait(10)
+
+        # a second execution waits for the block fetch of the first one,
+        # it asks for another roi, so that the gets are not coalesced
+        slicing2 = make_key[0:1, 0:10, 10:15, 0:10, 0:1]
+        req2 = opCache.Output( slicing2 )
+        req2.submit()
+        deadline = time.time() + 10
+        while len(opCache._fetchWaiters) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(opCache._fetchWaiters) == 1
+
+        # the shared block fetch is not canceled with the first execution
+        req.cancel()
+        assert req.canceled
+        assert (opCache._blockState[0, 0, 1, 0, 0] == OpArrayCache.IN_PROCESS)
+
+        opProvider.proceed.set()
+        data = req2.wait()
+        assert (data == self.data[slicing2]).all()
+        assert opProvider.accessCount == 1
+        assert (opCache._blockState[0, 0, 1, 0, 0] == OpArrayCache.CLEAN)
+        assert len(opCache._fetchWaiters) == 0
+
 if __name__ == "__main__":
     import sys
     import nose
@@ -0,0 +1,87 @@
+import numpy
+from lazyflow.graph import Graph, OrderedSignal, OperatorWrapper
+from lazyflow.operators import OpArrayPiper
+
+class TestOrderedSignal(object):
+
+    def setUp(self):
+        self.signal = OrderedSignal()
+        self.calls = []
+
+    def _callback(self, name):
+        def callback(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        callback.__name__ = name
+        return callback
+
+    def test_order(self):
+        a, b, c = [self._callback(name) for name in "abc"]
+        self.signal.subscribe(a)
+        self.signal.subscribe(b, x = 1)
+        self.signal.subscribe(c)
+        # subscribing again moves the function to the end
+        self.signal.subscribe(a)
+        self.signal(7)
+        assert self.calls == [("b", (7,), {"x" : 1}), ("c", (7,), {}), ("a", (7,), {})]
+
+    def test_unsubscribe(self):
+        callbacks = [self._callback(str(i)) for i in range(10)]
+        for f in callbacks:
+            self.signal.subscribe(f)
+        for f in callbacks[:8]:
+            self.signal.unsubscribe(f)
+        # unknown functions are ignored
+        self.signal.unsubscribe(callbacks[0])
+        assert len(self.signal.callbacks) < 10
+        self.signal()
+        assert [name for name, args, kwargs in self.calls] == ["8", "9"]
+
+        self.signal.subscribe(callbacks[0])
+        self.signal.unsubscribe(callbacks[9])
+        del self.calls[:]
+        self.signal()
+        assert [name for name, args, kwargs in self.calls] == ["8", "0"]
+
+    def test_unsubscribeWhileEmitting(self):
+        b = self._callback("b")
+        c = self._callback("c")
+        def a():
+            self.calls.append(("a", (), {}))
+            self.signal.unsubscribe(a)
+            self.signal.unsubscribe(b)
+        self.signal.subscribe(a)
+        self.signal.subscribe(b)
+        self.signal.subscribe(c)
+        self.signal()
+        assert [name for name, args, kwargs in self.calls] == ["a", "c"]
+        self.signal()
+        assert [name for name, args, kwargs in self.calls] == ["a", "c", "c"]
+
+class TestLazySlotSignals(object):
+
+    def test_slotSignals(self):
+        g = Graph()
+        op = OpArrayPiper(graph = g)
+        assert not isinstance(op.Output._sig_dirty, OrderedSignal)
+        # slots have no instance dictionary
+        assert not hasattr(op.Output, "__dict__")
+
+        dirty = []
+        def handleDirty(slot, roi):
+            dirty.append(roi)
+        op.Input.setValue(numpy.zeros((2, 2)))
+        op.Output.notifyDirty(handleDirty)
+        assert isinstance(op.Output._sig_dirty, OrderedSignal)
+        op.Input.setDirty(slice(None))
+        assert len(dirty) == 1
+        op.Output.unregisterDirty(handleDirty)
+        op.Input.setDirty(slice(None))
+        assert len(dirty) == 1
+
+    def test_multiSlotCondition(self):
+        g = Graph()
+        op = OperatorWrapper(OpArrayPiper, graph = g)
+        op.Input.resize(1)
+        assert op.Output._slotCondition is None
+        condition = op.Output._condition
+        assert op.Output._condition is condition
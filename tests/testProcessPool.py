@@ -0,0 +1,86 @@
+import os
+import numpy
+from lazyflow.graph import Graph, Operator, InputSlot, OutputSlot
+from lazyflow.request import Request, Pool
+from lazyflow.processpool import ProcessPool
+
+def _square(a):
+    return a * a
+
+def _pid(a):
+    return os.getpid()
+
+def _fail(a):
+    raise ValueError("expected failure")
+
+class OpSquare(Operator):
+    name = "OpSquare"
+    executeInProcess = True
+
+    Input = InputSlot()
+    Output = OutputSlot()
+
+    def setupOutputs(self):
+        self.Output.meta.assignFrom(self.Input.meta)
+
+    def execute(self, slot, subindex, roi, result):
+        data = self.Input(roi.start, roi.stop).wait()
+        return self.computeInProcess(_square, (data,), result)
+
+    def propagateDirty(self, slot, subindex, roi):
+        self.Output.setDirty(roi)
+
+class TestProcessPool(object):
+
+    def setUp(self):
+        self.pool = ProcessPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_compute(self):
+        data = numpy.random.random((10, 20))
+        result = numpy.zeros_like(data)
+        assert self.pool.compute(_square, (data,), result) is result
+        assert (result == data * data).all()
+
+    def test_runsInOtherProcess(self):
+        result = numpy.zeros((1,), dtype=int)
+        self.pool.compute(_pid, (None,), result)
+        assert result[0] != os.getpid()
+
+    def test_computeInRequests(self):
+        data = numpy.random.random((4, 100))
+        results = [numpy.zeros(100) for i in range(4)]
+
+        def work(i):
+            self.pool.compute(_square, (data[i],), results[i])
+
+        pool = Pool()
+        for i in range(4):
+            pool.request(work, i = i)
+        pool.wait()
+        for i in range(4):
+            assert (results[i] == data[i] * data[i]).all()
+
+    def test_error(self):
+        result = numpy.zeros((3,))
+        try:
+            self.pool.compute(_fail, (None,), result)
+        except RuntimeError, e:
+            assert "expected failure" in str(e)
+        else:
+            assert False, "compute() should raise a RuntimeError"
+
+    def test_operator(self):
+        g = Graph()
+        op = OpSquare(graph = g)
+        data = numpy.random.random((10, 20, 30))
+        op.Input.setValue(data)
+        result = op.Output[2:5, :, 10:20].wait()
+        assert (result == data[2:5, :, 10:20]**2).all()
+
+        # without the flag the computation runs in the calling thread
+        op.executeInProcess = False
+        result = op.Output[:].wait()
+        assert (result == data**2).all()
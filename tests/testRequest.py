@@ -1,11 +1,13 @@
-from lazyflow.request import Request, global_thread_pool
+from lazyflow.request import Request, Pool, ThreadPool, RequestTimeoutError, global_thread_pool
 import os
 import time
 import random
 import numpy
 import h5py
+from lazyflow.graph import ValueRequest
 
 import threading
+import greenlet
 
 class TestRequest(object):
     
@@ -76,6 +78,8 @@ class TestRequest(object):
 
         req = Request(someWork, depth=maxDepth, force=True)
         req.wait()
+        # finish callbacks may still run after wait() returned
+        global_thread_pool.drain()
         h5File.close()
 
         print "finished testWithH5Py"
@@ -193,10 +197,13 @@ class TestRequest(object):
         req2 = Request(someWork, depth=6, force=True)
         req2.notify(blubb)
         global_thread_pool.unpause()
-        assert req2.finished == False
         assert req.finished
         req.wait()
-
+        # requests submitted while the pool was paused are held back, not dropped
+        req2.wait()
+        assert req2.finished
+        # finish callbacks may still run after wait() returned
+        global_thread_pool.drain()
         
         # Handler should have been called once for each request we fired
         assert handlerCounter[0] == requestCounter[0]
@@ -209,6 +216,614 @@ class TestRequest(object):
         print "waited for all subrequests"
 
 
+    def test_pauseHoldsTopLevelRequests(self):
+        threadPool = ThreadPool(1)
+        threadPool.pause()
+        # the priority of a top level request does not matter
+        req = Request(lambda: "done")
+        req.threadPool = threadPool
+        req.setPriority(-5)
+        req.submit()
+        time.sleep(0.05)
+        assert not req.finished
+        threadPool.unpause()
+        assert req.wait(timeout = 10) == "done"
+        threadPool.stopThreadPool()
+
+    def test_priorityOrder(self):
+        """
+        Queued requests must be started in the order of their priority,
+        deeper (more negative) priorities first, equal priorities in submission order.
+        """
+        # occupy all workers, so that nobody takes the requests from the queue
+        event = threading.Event()
+        started = []
+        def block():
+            started.append(True)
+            event.wait()
+        blockers = [Request(block) for i in range(global_thread_pool.numThreads)]
+        for r in blockers:
+            r.submit()
+        while len(started) < len(blockers):
+            time.sleep(0.001)
+
+        def work():
+            pass
+        requests = []
+        for prio in [0, -1, -3, -1, 0]:
+            req = Request(work)
+            req.prio = prio
+            requests.append(req)
+        for req in requests:
+            req.submit()
+
+        popped = []
+        for i in range(len(requests)):
+            popped.append(global_thread_pool._popRequest(global_thread_pool.lastWorker))
+        expected = [requests[2], requests[1], requests[3], requests[0], requests[4]]
+        try:
+            assert popped == expected
+        finally:
+            for req in popped:
+                req._execute()
+            event.set()
+        for r in blockers:
+            r.wait()
+
+
+    def test_childRequestsStayLocal(self):
+        """
+        Requests submitted from inside a request must be queued on the
+        worker that runs the parent request.
+        """
+        # occupy all workers but one, so that nobody steals the child requests
+        event = threading.Event()
+        started = []
+        def block():
+            started.append(True)
+            event.wait()
+        blockers = [Request(block) for i in range(global_thread_pool.numThreads - 1)]
+        for r in blockers:
+            r.submit()
+        while len(started) < len(blockers):
+            time.sleep(0.001)
+
+        def child():
+            return threading.current_thread()
+
+        def parent():
+            worker = threading.current_thread()
+            children = [Request(child) for i in range(3)]
+            for c in children:
+                c.submit()
+            queued = [entry[2] for entry in worker.requests]
+            results = [c.wait() for c in children]
+            return queued == children and results == [worker] * 3
+
+        try:
+            assert Request(parent).submit().wait()
+        finally:
+            event.set()
+        for r in blockers:
+            r.wait()
+
+    def test_inlineCheapChildRequests(self):
+        """
+        Only cheap child requests that are still queued are executed
+        by the greenlet of the parent request that waits for them.
+        """
+        threadPool = ThreadPool(1)
+        def child():
+            return greenlet.getcurrent()
+
+        def parent(cheap):
+            c = Request(child)
+            c.cheap = cheap
+            c.submit()
+            return c.wait() is greenlet.getcurrent()
+
+        for cheap in (True, False):
+            req = Request(parent, cheap = cheap)
+            req.threadPool = threadPool
+            assert req.submit().wait() == cheap
+        threadPool.stopThreadPool()
+
+
+    def test_drain(self):
+        event = threading.Event()
+        def work():
+            event.wait()
+
+        req = Request(work).submit()
+        assert global_thread_pool.drain(timeout = 0.05) == False
+        event.set()
+        assert global_thread_pool.drain(timeout = 10)
+        assert req.finished
+
+
+    def test_resizeThreadPool(self):
+        pool = ThreadPool(2)
+        assert len(pool.workers) == 2
+        pool.resize(4)
+        assert len(pool.workers) == 4
+
+        def work(i):
+            time.sleep(0.001)
+            return i
+        requests = []
+        for i in range(20):
+            req = Request(work, i = i)
+            req.threadPool = pool
+            requests.append(req)
+        for req in requests:
+            req.submit()
+
+        # shrink the pool while the requests are running
+        retired = list(pool.workers)
+        pool.resize(1)
+        assert len(pool.workers) == 1
+        assert [req.wait() for req in requests] == range(20)
+
+        for w in retired:
+            if w not in pool.workers:
+                w.join(5)
+                assert not w.is_alive()
+        pool.stopThreadPool()
+
+
+    def test_graphThreadPool(self):
+        from lazyflow.graph import Graph
+        g = Graph()
+        assert g.threadPool is global_thread_pool
+
+        g = Graph(numThreads = 2)
+        assert g.threadPool is not global_thread_pool
+        assert len(g.threadPool.workers) == 2
+        g.finalize()
+
+
+    def test_waitTimeout(self):
+        # use a separate pool, the slow request blocks one of its workers
+        pool = ThreadPool(2)
+        event = threading.Event()
+        def slow():
+            event.wait()
+            return "slow"
+
+        # waiting from a foreign thread
+        req = Request(slow)
+        req.threadPool = pool
+        try:
+            req.wait(timeout = 0.05)
+            assert False, "wait() should have timed out"
+        except RequestTimeoutError:
+            pass
+
+        # waiting from inside a request
+        def impatient():
+            try:
+                return req.wait(timeout = 0.05)
+            except RequestTimeoutError:
+                return "fallback"
+        req2 = Request(impatient)
+        req2.threadPool = pool
+        assert req2.submit().wait() == "fallback"
+
+        event.set()
+        assert req.wait(timeout = 10) == "slow"
+        pool.stopThreadPool()
+
+    def test_poolWaitTimeout(self):
+        threadPool = ThreadPool(3)
+        event = threading.Event()
+        def slow():
+            event.wait()
+
+        pool = Pool()
+        for i in range(3):
+            pool.request(slow).threadPool = threadPool
+        try:
+            pool.wait(timeout = 0.05)
+            assert False, "wait() should have timed out"
+        except RequestTimeoutError:
+            pass
+        event.set()
+        pool.wait(timeout = 10)
+        assert pool.finished
+        threadPool.stopThreadPool()
+
+    def test_valueRequestWaitTimeout(self):
+        # slots with a value return ValueRequests, they are waited for like requests
+        assert ValueRequest(5).wait(timeout = 0.05) == 5
+        pool = Pool()
+        pool.add(ValueRequest(6))
+        pool.add(ValueRequest(7))
+        pool.wait(timeout = 0.05)
+        assert pool.finished
+
+    def test_instrumentation(self):
+        threadPool = ThreadPool(2)
+        Request.EnableInstrumentation = True
+        try:
+            def child():
+                time.sleep(0.01)
+
+            def parent():
+                children = [Request(child) for i in range(4)]
+                for r in children:
+                    r.submit()
+                for r in children:
+                    r.wait()
+
+            req = Request(parent)
+            req.threadPool = threadPool
+            req.submit()
+            req.wait()
+            threadPool.drain()
+        finally:
+            Request.EnableInstrumentation = False
+        threadPool.stopThreadPool()
+
+        assert req.submitTime <= req.startTime <= req.finishTime
+        assert req.workerId is not None
+        assert req.switchCount >= 1
+        stats = threadPool.statistics()
+        assert stats["executionTime"].count == 5
+        assert stats["executionTime"].max >= 0.01
+        assert stats["queueLatency"].count >= 1
+        assert stats["switches"].count == 5
+        assert sum(c for bound, c in stats["switches"].bins()) == 5
+
+        threadPool.resetStatistics()
+        assert threadPool.statistics()["executionTime"].count == 0
+
+    def test_imap(self):
+        lock = threading.Lock()
+        inFlight = [0]
+        maxInFlight = [0]
+
+        def square(x):
+            with lock:
+                inFlight[0] += 1
+                maxInFlight[0] = max(maxInFlight[0], inFlight[0])
+            time.sleep(0.001 * random.random())
+            with lock:
+                inFlight[0] -= 1
+            return x * x
+
+        consumed = []
+        def items():
+            # the window must not consume the items in advance
+            for i in range(50):
+                assert i - len(consumed) <= 3
+                yield i
+
+        for item, result in Pool.imap(lambda i: Request(square, x = i), items(), max_in_flight = 3):
+            assert result == item * item
+            consumed.append(item)
+        assert consumed == range(50)
+        assert maxInFlight[0] <= 3
+
+        results = dict(Pool.imap(lambda i: Request(square, x = i), range(50), ordered = False))
+        assert results == dict((i, i * i) for i in range(50))
+
+    def test_imapMaxBytes(self):
+        started = []
+        def work(x):
+            started.append(x)
+            return x
+
+        consumed = []
+        for item, result in Pool.imap(lambda i: Request(work, x = i), range(20), max_in_flight = 10,
+                                      max_bytes = 300, nbytes = lambda i: 100):
+            assert len(started) - len(consumed) <= 3
+            consumed.append(item)
+        assert consumed == range(20)
+
+        # an item that is larger than max_bytes is still processed
+        results = list(Pool.imap(lambda i: Request(work, x = i), [1, 2], max_bytes = 10, nbytes = lambda i: 100))
+        assert results == [(1, 1), (2, 2)]
+
+    def test_asCompleted(self):
+        def work(delay):
+            time.sleep(delay)
+            return delay
+
+        def inRequest():
+            requests = [Request(work, delay = d) for d in (0.03, 0.0, 0.01)]
+            return [r.result for r in Pool.as_completed(requests)]
+
+        threadPool = ThreadPool(4)
+        req = Request(inRequest)
+        req.threadPool = threadPool
+        req.submit()
+        results = req.wait()
+        threadPool.stopThreadPool()
+        assert sorted(results) == [0.0, 0.01, 0.03]
+        assert results[-1] == 0.03
+
+        requests = [Request(work, delay = d) for d in (0.0, 0.01)]
+        assert set(Pool.as_completed(requests)) == set(requests)
+
+    def test_asCompletedCancel(self):
+        threadPool = ThreadPool(2)
+        event = threading.Event()
+        def work(block):
+            if block:
+                event.wait()
+            return block
+
+        requests = [Request(work, block = b) for b in (True, False)]
+        for r in requests:
+            r.threadPool = threadPool
+        completed = []
+        def consume():
+            completed.extend(Pool.as_completed(requests))
+        thread = threading.Thread(target = consume)
+        thread.start()
+        time.sleep(0.05)
+        # the canceled request is not yielded and does not block the consumer
+        requests[0].cancel()
+        thread.join(10)
+        assert not thread.isAlive()
+        assert completed == [requests[1]]
+        event.set()
+        threadPool.stopThreadPool()
+
+
+    def test_cancel(self):
+        threadPool = ThreadPool(1)
+        threadPool.compactionThreshold = 4
+        event = threading.Event()
+        def slow():
+            event.wait()
+
+        def work(destination):
+            destination[:] = 1
+            return destination
+
+        blocker = Request(slow)
+        blocker.threadPool = threadPool
+        blocker.submit()
+
+        canceledCallbacks = []
+        requests = []
+        for i in range(20):
+            req = Request(work, destination = numpy.zeros(10))
+            req.threadPool = threadPool
+            # callbacks that return None accept the cancellation
+            req.onCancel(lambda r: canceledCallbacks.append(r))
+            requests.append(req.submit())
+
+        for req in requests[:15]:
+            req.cancel()
+        assert len(canceledCallbacks) == 15
+        for req in requests[:15]:
+            assert req.canceled
+            # the arguments (and with them the destination) are dropped
+            assert req.kwargs == {}
+            # waiting for a canceled request returns immediately
+            assert req.wait() is None
+        # the canceled requests were removed from the queue
+        assert len(threadPool._queue) < 15
+
+        # a callback that returns False refuses the cancellation
+        requests[15].onCancel(lambda r: False)
+        requests[15].cancel()
+        assert not requests[15].canceled
+
+        event.set()
+        assert threadPool.drain(timeout = 10)
+        for req in requests[15:]:
+            assert (req.wait() == 1).all()
+        threadPool.stopThreadPool()
+
+    def test_cancelWakesWaiters(self):
+        threadPool = ThreadPool(2)
+        event = threading.Event()
+        def slow():
+            event.wait()
+            return "slow"
+
+        req = Request(slow)
+        req.threadPool = threadPool
+        req.submit()
+
+        def waitForSlow():
+            return req.wait()
+        waiter = Request(waitForSlow)
+        waiter.threadPool = threadPool
+        waiter.submit()
+        time.sleep(0.05)
+
+        results = []
+        thread = threading.Thread(target = lambda: results.append(req.wait()))
+        thread.start()
+        time.sleep(0.05)
+
+        req.cancel()
+        assert waiter.wait(timeout = 10) is None
+        thread.join(10)
+        assert results == [None]
+        event.set()
+        threadPool.stopThreadPool()
+
+    def test_cancelDoesNotResumeParent(self):
+        threadPool = ThreadPool(2)
+        childPool = ThreadPool(1)
+        siblingPool = ThreadPool(1)
+        event = threading.Event()
+        started = threading.Event()
+        def slow():
+            started.set()
+            event.wait()
+            return "slow"
+
+        resumed = []
+        def parentWork():
+            sibling = Request(event.wait)
+            sibling.threadPool = siblingPool
+            # canceling the sibling takes a while, the workers must not
+            # resume the parent before it is marked as canceled
+            sibling.onCancel(lambda r: time.sleep(0.2))
+            child = Request(slow)
+            child.threadPool = childPool
+            result = child.wait()
+            resumed.append(result)
+            return result
+
+        parent = Request(parentWork)
+        parent.threadPool = threadPool
+        parent.submit()
+        assert started.wait(10)
+        time.sleep(0.05)
+
+        parent.cancel()
+        assert parent.canceled
+        time.sleep(0.1)
+        assert resumed == []
+        assert all(w.isAlive() for w in threadPool.workers)
+        event.set()
+        threadPool.stopThreadPool()
+        childPool.stopThreadPool()
+        siblingPool.stopThreadPool()
+
+    def test_onFailure(self):
+        threadPool = ThreadPool(1)
+        def work():
+            raise ValueError("failed")
+
+        failures = []
+        req = Request(work)
+        req.threadPool = threadPool
+        req.onFailure(lambda r, e: failures.append(e))
+        # the exception is passed on and kills the worker
+        req.submit()
+        assert threadPool.drain(timeout = 10)
+        assert len(failures) == 1
+        assert isinstance(failures[0], ValueError)
+        threadPool.stopThreadPool()
+
+    def test_setPriority(self):
+        threadPool = ThreadPool(1)
+        event = threading.Event()
+        def slow():
+            event.wait()
+
+        order = []
+        def work(i):
+            order.append(i)
+
+        blocker = Request(slow)
+        blocker.threadPool = threadPool
+        blocker.submit()
+
+        requests = []
+        for i in range(5):
+            req = Request(work, i = i)
+            req.threadPool = threadPool
+            requests.append(req.submit())
+        # boost the last request, demote the first one
+        assert requests[4].setPriority(-5) is requests[4]
+        requests[0].setPriority(5)
+        event.set()
+        assert threadPool.drain(timeout = 10)
+        assert order == [4, 1, 2, 3, 0]
+        threadPool.stopThreadPool()
+
+    def test_setPriorityOfChildren(self):
+        threadPool = ThreadPool(1)
+        created = threading.Event()
+        proceed = threading.Event()
+
+        order = []
+        def work(i):
+            order.append(i)
+
+        def parent():
+            for i in range(3):
+                Request(work, i = i).submit()
+            created.set()
+            proceed.wait()
+
+        req = Request(parent)
+        req.threadPool = threadPool
+        req.submit()
+        assert created.wait(10)
+
+        other = Request(work, i = "other")
+        other.threadPool = threadPool
+        other.submit()
+
+        # the queued children of the parent are demoted along with it
+        req.setPriority(10)
+        children = list(req.child_requests)
+        assert len(children) == 3
+        assert all(child.prio == 9 for child in children)
+
+        proceed.set()
+        assert threadPool.drain(timeout = 10)
+        assert order[0] == "other"
+        assert sorted(order[1:]) == [0, 1, 2]
+        threadPool.stopThreadPool()
+
+    def test_fairShare(self):
+        threadPool = ThreadPool(1)
+        event = threading.Event()
+        def slow():
+            event.wait()
+
+        order = []
+        def work(client):
+            order.append(client)
+
+        blocker = Request(slow)
+        blocker.threadPool = threadPool
+        blocker.submit()
+
+        def submit(client):
+            req = Request(work, client = client)
+            req.threadPool = threadPool
+            req.client = client
+            req.submit()
+
+        for i in range(50):
+            submit("batch")
+        for i in range(5):
+            submit("gui")
+        event.set()
+        assert threadPool.drain(timeout = 10)
+        # the clients take turns although the batch client queued first
+        assert order[:10].count("gui") == 5
+
+        # a client with twice the weight gets twice the share
+        threadPool.setClientWeight("gui", 2)
+        del order[:]
+        event.clear()
+        blocker = Request(slow)
+        blocker.threadPool = threadPool
+        blocker.submit()
+        for i in range(30):
+            submit("batch")
+            submit("gui")
+        event.set()
+        assert threadPool.drain(timeout = 10)
+        assert order[:30].count("gui") >= 19
+        threadPool.stopThreadPool()
+
+    def test_graphClient(self):
+        from lazyflow.graph import Graph
+        from lazyflow.operators import OpArrayPiper
+
+        g = Graph(client = "gui")
+        op = OpArrayPiper(graph = g)
+        op.Input.setValue(numpy.zeros((10, 10)))
+        op2 = OpArrayPiper(graph = g)
+        op2.Input.connect(op.Output)
+        req = op2.Output[:]
+        assert req.client == "gui"
+        assert (req.wait() == 0).all()
+
         
 if __name__ == "__main__":
     import nose
@@ -0,0 +1,74 @@
+import time
+import threading
+from lazyflow.request import Request, ThreadPool, Lock
+from lazyflow.watchdog import Watchdog
+
+class TestWatchdog(object):
+
+    def setUp(self):
+        self.threadPool = ThreadPool(2)
+        self.reports = []
+        self.watchdog = Watchdog(threshold = 1.0, callback = lambda pool, report: self.reports.append((pool, report)))
+
+    def tearDown(self):
+        self.threadPool.stopThreadPool()
+
+    def _submit(self, function, **kwargs):
+        req = Request(function, **kwargs)
+        req.threadPool = self.threadPool
+        return req.submit()
+
+    def test_stalledPool(self):
+        proceed = threading.Event()
+        lock = Lock()
+        def holdLock():
+            lock.acquire()
+            proceed.wait()
+            lock.release()
+
+        def waitForLock():
+            lock.acquire()
+            lock.release()
+
+        req1 = self._submit(holdLock)
+        time.sleep(0.1)
+        req2 = self._submit(waitForLock)
+        time.sleep(0.1)
+
+        now = time.time()
+        assert self.watchdog.check(now) == []
+        assert self.watchdog.check(now + 0.5) == []
+        assert self.watchdog.check(now + 2.0) == [self.threadPool]
+        # every stall is reported once
+        assert self.watchdog.check(now + 3.0) == [self.threadPool]
+        reports = [report for pool, report in self.reports if pool is self.threadPool]
+        assert len(reports) == 1
+        report = reports[0]
+        assert "proceed.wait()" in report
+        assert "holdLock" in report.split("Held request.Locks:")[1]
+        assert "waitForLock" in report.split("Suspended greenlets:")[1]
+
+        proceed.set()
+        req1.wait()
+        req2.wait()
+        self.threadPool.drain()
+        assert self.watchdog.check(now + 4.0) == []
+
+    def test_busyPoolIsNotStalled(self):
+        def work():
+            time.sleep(0.01)
+
+        now = time.time()
+        self.watchdog.check(now)
+        for i in range(5):
+            self._submit(work)
+            time.sleep(0.05)
+            assert self.watchdog.check(now + 2.0 * (i + 1)) == []
+        self.threadPool.drain()
+
+    def test_thread(self):
+        self.watchdog.interval = 0.01
+        self.watchdog.start()
+        time.sleep(0.05)
+        self.watchdog.stop()
+        assert not self.watchdog.is_alive()